@@ -0,0 +1,42 @@
+"""add rolling anomalies table
+
+Revision ID: 5c1e8f2a7b90
+Revises: 9eef5ef4a972
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c1e8f2a7b90"
+down_revision: Union[str, Sequence[str], None] = "9eef5ef4a972"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "anomalies",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("symbol", sa.VARCHAR(length=10), nullable=False),
+        sa.Column("window_days", sa.Integer(), nullable=False),
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("bar_index", sa.Integer(), nullable=False),
+        sa.Column("daily_return", sa.Double(), nullable=False),
+        sa.Column("z_score", sa.Double(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "symbol", "window_days", "date", name="uq_anomaly_symbol_window_date"
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("anomalies")
@@ -0,0 +1,20 @@
+from fastapi import Request
+
+from core.config import settings
+from core.metrics import request_labels
+from services.stocks import period_mapping
+
+
+async def set_request_labels(request: Request) -> None:
+    """Label the metrics recorded while serving a request with its route and period."""
+    route = request.scope["route"]
+    endpoint = route.path.removeprefix(settings.API_V1_STR)
+    # Period routes end with their period, the others take it as timeframe
+    period = request.path_params.get("timeframe", endpoint.rsplit("/", 1)[-1])
+    if period not in period_mapping:
+        period = ""
+
+    labels = {"endpoint": endpoint, "period": period}
+    request_labels.set(labels)
+    # Read back by the middleware timing the whole request
+    request.state.metric_labels = labels
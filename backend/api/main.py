@@ -1,6 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from api.deps import set_request_labels
 from api.routes import stocks, health
 
-api_router = APIRouter()
+api_router = APIRouter(dependencies=[Depends(set_request_labels)])
 api_router.include_router(stocks.router)
 api_router.include_router(health.router)
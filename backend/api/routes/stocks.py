@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Dict, Any
 
 from models.stock_data import StockData
-from db.session import get_db, Session as s
+from db.session import get_db, get_async_db
 from schemas.stock_data import (
     Stock1MoResponse,
     Stock3MoResponse,
@@ -12,11 +13,11 @@ from schemas.stock_data import (
     Stock1YResponse,
     Stock5YResponse,
 )
-from data.z_score import extract_normalized_prices, prices_to_numpy_arr, calc_z_score
-from data.performance import get_performance_ranking
 from core.metrics import REQUEST_COUNTER
-from utils.decorators import cache_stock_data
-from services.stocks import get_stock_prices_by_period
+from data.z_score import Z_SCORE_THRESHOLD
+from services.analytics import get_anomalies, get_performance
+from utils.decorators import cache_analytics, cache_stock_data
+from services.stocks import get_stock_prices_by_period_async
 
 router = APIRouter(prefix="/stocks", tags=["stocks"])
 
@@ -25,50 +26,50 @@ router = APIRouter(prefix="/stocks", tags=["stocks"])
 @cache_stock_data(ttl=86400)
 async def get_stocks_1mo(
     symbols: str = Query(..., description="Comma-separated list of stock symbols"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> dict[str, list[Stock1MoResponse]]:
     REQUEST_COUNTER.labels(endpoint="/stocks/1mo").inc()
-    return get_stock_prices_by_period("1mo", symbols, db)
+    return await get_stock_prices_by_period_async("1mo", symbols, db)
 
 
 @router.get("/3mo")
 @cache_stock_data(ttl=86400)
 async def get_stocks_3mo(
     symbols: str = Query(..., description="Comma-separated list of stock symbols"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> dict[str, list[Stock3MoResponse]]:
     REQUEST_COUNTER.labels(endpoint="/stocks/3mo").inc()
-    return get_stock_prices_by_period("3mo", symbols, db)
+    return await get_stock_prices_by_period_async("3mo", symbols, db)
 
 
 @router.get("/6mo")
 @cache_stock_data(ttl=86400)
 async def get_stocks_6mo(
     symbols: str = Query(..., description="Comma-separated list of stock symbols"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> dict[str, list[Stock6MoResponse]]:
     REQUEST_COUNTER.labels(endpoint="/stocks/6mo").inc()
-    return get_stock_prices_by_period("6mo", symbols, db)
+    return await get_stock_prices_by_period_async("6mo", symbols, db)
 
 
 @router.get("/1y")
 @cache_stock_data(ttl=86400)
 async def get_stocks_1y(
     symbols: str = Query(..., description="Comma-separated list of stock symbols"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> dict[str, list[Stock1YResponse]]:
     REQUEST_COUNTER.labels(endpoint="/stocks/1y").inc()
-    return get_stock_prices_by_period("1y", symbols, db)
+    return await get_stock_prices_by_period_async("1y", symbols, db)
 
 
 @router.get("/5y")
 @cache_stock_data(ttl=86400)
 async def get_stocks_5y(
     symbols: str = Query(..., description="Comma-separated list of stock symbols"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> dict[str, list[Stock5YResponse]]:
     REQUEST_COUNTER.labels(endpoint="/stocks/5y").inc()
-    return get_stock_prices_by_period("5y", symbols, db)
+    return await get_stock_prices_by_period_async("5y", symbols, db)
 
 
 @router.get("/symbols")
@@ -80,35 +81,44 @@ def get_stock_symbols(db: Session = Depends(get_db)) -> list[str]:
 
 
 @router.get("/anomalies/{timeframe}", response_model=Dict[str, List[Dict[str, Any]]])
+@cache_analytics("anomalies", ttl=86400)
 async def get_stock_anomalies(
     timeframe: str,
     symbols: str = Query(..., description="Comma-separated list of symbols"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    threshold: float = Query(
+        Z_SCORE_THRESHOLD,
+        gt=0,
+        description="Absolute z-score above which a daily return is an anomaly",
+    ),
+    window: int | None = Query(
+        None,
+        description="Trading days of the rolling window returns are scored "
+        "against, the whole timeframe when omitted",
+    ),
 ):
     try:
-        price_data = await extract_normalized_prices(timeframe, symbols, db)
-
-        if not price_data:
-            return {}
-
-        numpy_arr = prices_to_numpy_arr(price_data)
-        anomalies = calc_z_score(numpy_arr)
-
-        return anomalies
+        return await get_anomalies(timeframe, symbols, db, threshold, window)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Analysis failed: {e}")
         raise HTTPException(status_code=500, detail="Failed to analyze stocks data")
 
 
 @router.get("/performance/{timeframe}")
+@cache_analytics("performance", ttl=86400)
 async def get_stock_performance_extremes(
-    timeframe: str, symbols: str = Query(...), db: Session = Depends(get_db)
+    timeframe: str,
+    symbols: str | None = Query(
+        None, description="Comma-separated list of symbols, every stock when omitted"
+    ),
+    db: AsyncSession = Depends(get_async_db),
+    top: int | None = Query(None, ge=1, description="Also list the k best stocks"),
+    bottom: int | None = Query(None, ge=1, description="Also list the k worst stocks"),
 ):
     """
     Returns the Best and Worst performing stocks for the given timeframe.
     """
-    price_data = await extract_normalized_prices(timeframe, symbols, db)
-    result = get_performance_ranking(price_data)
-
-    return result
+    return await get_performance(timeframe, symbols, db, top, bottom)
@@ -0,0 +1,105 @@
+"""
+Compare the two ways of loading the analytics price panel: the Decimal rows
+of the period query grouped into columns per symbol, and the binary COPY of
+float8 prices parsed straight into NumPy arrays.
+
+Reads the given symbols over the chosen period from the configured database
+and reports the best time per request with the panel built:
+
+    python -m benchmarks.bench_analytics_fetch --period 5y --runs 5 \\
+        --symbols AAPL.US,MSFT.US,NVDA.US
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import date
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+from data.price_panel import PricePanel, load_price_panel
+from db.session import AsyncSession
+from services.data_version import data_version
+from services.stocks import build_period_query, period_mapping
+
+
+def panel_from_columns(columns: dict[str, tuple[list[date], list]]) -> PricePanel:
+    """Align (dates, values) columns per symbol, missing values become NaN."""
+    symbols = list(columns)
+    dates = sorted(set().union(*(days for days, _ in columns.values())))
+    # Converting date objects to datetime64 is far slower than hashing them
+    row_of = {day: row for row, day in enumerate(dates)}
+
+    lengths = [len(days) for days, _ in columns.values()]
+    rows = np.fromiter(
+        (row_of[day] for days, _ in columns.values() for day in days),
+        dtype=np.intp,
+        count=sum(lengths),
+    )
+    values = np.array(
+        [value for _, column in columns.values() for value in column],
+        dtype=np.float64,
+    )
+
+    # Scatter every value to its date's row and symbol's column at once
+    cols = np.repeat(np.arange(len(symbols)), lengths)
+    prices = np.full((len(dates), len(symbols)), np.nan, order="F")
+    prices[rows, cols] = values
+
+    return PricePanel(np.array(dates, dtype="datetime64[D]"), symbols, prices)
+
+
+async def read_columns(db, period, symbols):
+    symbol_list = sorted({s.strip().upper() for s in symbols.split(",")})
+    stmt = build_period_query(period, symbol_list, await data_version.get_max_date(db))
+    rows = (await db.execute(stmt)).all()
+
+    columns = {}
+    for symbol, group in groupby(rows, key=itemgetter(0)):
+        _, dates, values = zip(*group)
+        columns[symbol] = (list(dates), list(values))
+    return panel_from_columns(columns)
+
+
+async def read_copy(db, period, symbols):
+    return await load_price_panel(period, symbols, db)
+
+
+async def measure(read, period, symbols):
+    # A fresh session per request, as the API dependency does
+    async with AsyncSession() as db:
+        start = time.perf_counter()
+        panel = await read(db, period, symbols)
+        elapsed = time.perf_counter() - start
+    return elapsed, panel
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", required=True)
+    parser.add_argument("--period", default="5y", choices=list(period_mapping))
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    panels = {}
+    print(f"{len(args.symbols.split(','))} symbols, {args.period}, {args.runs} runs")
+    for read in (read_columns, read_copy):
+        results = [
+            await measure(read, args.period, args.symbols) for _ in range(args.runs)
+        ]
+        best = min(elapsed for elapsed, _ in results)
+        panels[read.__name__] = panel = results[-1][1]
+        print(
+            f"{read.__name__:<13} best {best * 1000:>8.1f}ms  "
+            f"panel {panel.prices.shape[0]} x {panel.prices.shape[1]}"
+        )
+
+    columns, copied = panels.values()
+    assert columns.symbols == copied.symbols
+    np.testing.assert_array_equal(columns.prices, copied.prices)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
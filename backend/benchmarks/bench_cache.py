@@ -0,0 +1,80 @@
+"""
+Latency of the period cache lookups against a local Redis as a function of
+the number of symbols per request: one GET/SETEX per symbol versus a single
+MGET and one pipelined SETEX transaction.
+
+Uses its own key prefix on a separate Redis database and deletes its keys:
+
+    python -m benchmarks.bench_cache --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import redis.asyncio as redis
+
+PERIOD = "5y"
+
+
+def make_payload(symbol: str, days: int) -> str:
+    return json.dumps(
+        [
+            {"symbol": symbol, "date": f"day-{i}", f"norm_{PERIOD}": 100 + i * 0.01}
+            for i in range(days)
+        ]
+    )
+
+
+async def sequential(client, keys, payloads, ttl):
+    values = [await client.get(key) for key in keys]
+    for key, payload in zip(keys, payloads):
+        await client.setex(key, ttl, payload)
+    return values
+
+
+async def pipelined(client, keys, payloads, ttl):
+    values = await client.mget(keys)
+    async with client.pipeline(transaction=True) as pipe:
+        for key, payload in zip(keys, payloads):
+            pipe.setex(key, ttl, payload)
+        await pipe.execute()
+    return values
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 5, 10, 20, 50])
+    parser.add_argument("--days", type=int, default=1260)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    client = redis.from_url(args.redis_url)
+    try:
+        print(f"{'symbols':>7}  {'get/setex':>10}  {'mget/pipeline':>13}")
+        for count in args.counts:
+            keys = [f"bench:stock:{PERIOD}:S{i}" for i in range(count)]
+            payloads = [make_payload(f"S{i}", args.days) for i in range(count)]
+
+            timings = {}
+            for method in (sequential, pipelined):
+                best = float("inf")
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    await method(client, keys, payloads, 60)
+                    best = min(best, time.perf_counter() - start)
+                timings[method.__name__] = best * 1000
+
+            print(
+                f"{count:>7}  {timings['sequential']:>8.2f}ms  "
+                f"{timings['pipelined']:>11.2f}ms"
+            )
+            await client.delete(*keys)
+    finally:
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+Bytes stored per symbol and period, and encode/decode cost, of the JSON
+cache values versus the compact (columnar + zstd) encoding.
+
+With --redis-url the values are also written to that Redis database and
+their MEMORY USAGE is reported, the keys are deleted afterwards:
+
+    python -m benchmarks.bench_cache_encoding --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import redis
+
+from utils.serialization import decode_compact, encode_compact, encode_records
+
+# Trading days per period
+PERIOD_ROWS = {"1mo": 22, "3mo": 64, "6mo": 127, "1y": 253, "5y": 1260}
+
+
+def make_records(symbol: str, period: str, rows: int):
+    # Random walk around 100 like the normalized prices
+    values = 100 + np.cumsum(np.random.default_rng(rows).normal(0, 1, rows))
+    end = date(2025, 6, 30)
+    return [
+        {
+            "symbol": symbol,
+            "date": end - timedelta(days=rows - i),
+            f"norm_{period}": Decimal(f"{value:.2f}"),
+        }
+        for i, value in enumerate(values)
+    ]
+
+
+def per_call_us(runs: int, func, arg) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        func(arg)
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--redis-url")
+    args = parser.parse_args()
+
+    client = redis.from_url(args.redis_url) if args.redis_url else None
+
+    print(
+        f"{'period':<6} {'rows':>5} {'json B':>8} {'compact B':>10} {'ratio':>6} "
+        f"{'json enc':>9} {'compact enc':>12} {'compact dec':>12}"
+        + (f" {'redis json':>11} {'redis compact':>14}" if client else "")
+    )
+    for period, rows in PERIOD_ROWS.items():
+        records = make_records("AAPL.US", period, rows)
+        fragment = encode_records(records)
+        compact = encode_compact(records)
+
+        line = (
+            f"{period:<6} {rows:>5} {len(fragment):>8} {len(compact):>10} "
+            f"{len(fragment) / len(compact):>5.1f}x "
+            f"{per_call_us(args.runs, encode_records, records):>7.0f}us "
+            f"{per_call_us(args.runs, encode_compact, records):>10.0f}us "
+            f"{per_call_us(args.runs, decode_compact, compact):>10.0f}us"
+        )
+        if client:
+            client.set("bench:json", fragment)
+            client.set("bench:compact", compact)
+            line += (
+                f" {client.memory_usage('bench:json'):>11}"
+                f" {client.memory_usage('bench:compact'):>14}"
+            )
+        print(line)
+
+    if client:
+        client.delete("bench:json", "bench:compact")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cost of building a cached period response, per request, without network.
+
+Compares the previous hit path (parse each cached JSON string, validate and
+serialize through the response model, render with orjson) with splicing the
+cached orjson fragments into the body:
+
+    python -m benchmarks.bench_cache_hit --symbols 20 --days 1260
+"""
+
+import argparse
+import json
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from schemas.stock_data import Stock5YResponse
+from utils.serialization import encode_records, join_symbol_fragments
+
+adapter = TypeAdapter(dict[str, list[Stock5YResponse]])
+
+
+def make_records(symbol: str, days: int):
+    end = date(2025, 6, 30)
+    return [
+        {
+            "symbol": symbol,
+            "date": end - timedelta(days=days - i),
+            "norm_5y": Decimal("100.00") + Decimal(i) / 100,
+        }
+        for i in range(days)
+    ]
+
+
+def response_model_path(parsed: dict) -> bytes:
+    validated = adapter.validate_python(parsed)
+    return orjson.dumps(adapter.dump_python(validated, mode="json"))
+
+
+def parse_and_render(cached: dict[str, str]) -> bytes:
+    return response_model_path({s: json.loads(v) for s, v in cached.items()})
+
+
+def best_of(runs: int, func, arg) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, default=20)
+    parser.add_argument("--days", type=int, default=1260)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    records = {
+        f"S{i:02d}.US": make_records(f"S{i:02d}.US", args.days)
+        for i in range(args.symbols)
+    }
+    # Entries as the previous decorator stored them in Redis and in memory
+    json_cached = {s: json.dumps(jsonable_encoder(r)) for s, r in records.items()}
+    parsed_cached = {s: json.loads(v) for s, v in json_cached.items()}
+    fragments = {s: encode_records(r) for s, r in records.items()}
+
+    print(f"{args.symbols} symbols x {args.days} rows")
+    for name, func, arg in (
+        ("redis hit, parse + response model", parse_and_render, json_cached),
+        ("local hit, response model", response_model_path, parsed_cached),
+        ("spliced fragments", join_symbol_fragments, fragments),
+    ):
+        print(f"{name:<36} {best_of(args.runs, func, arg):>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare rows/second of the INSERT and COPY ingestion paths of StockDataLoader.
+
+Runs against the configured database inside a transaction that is rolled back,
+so no benchmark rows are left behind:
+
+    python -m benchmarks.bench_ingest --years 30 --runs 3
+"""
+
+import argparse
+import time
+
+import pandas as pd
+from sqlalchemy.orm import sessionmaker
+
+from data.load_stock_data import StockDataLoader
+from db.engine import engine
+
+
+def make_dataframe(years: int) -> pd.DataFrame:
+    dates = pd.bdate_range(end="2025-01-01", periods=years * 252)
+    n = len(dates)
+    return pd.DataFrame(
+        {
+            "Date": dates,
+            "Open": [100 + i * 0.01 for i in range(n)],
+            "High": [101 + i * 0.01 for i in range(n)],
+            "Low": [99 + i * 0.01 for i in range(n)],
+            "Close": [100.5 + i * 0.01 for i in range(n)],
+            "Volume": [1000000 + i for i in range(n)],
+        }
+    )
+
+
+def time_load(loader: StockDataLoader, method: str, symbol: str) -> float:
+    loader.symbol = symbol
+    start = time.perf_counter()
+    getattr(loader, method)()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = sessionmaker(bind=connection)()
+
+    try:
+        df = make_dataframe(args.years)
+        # Bypass __init__, only the ingestion step is measured
+        loader = StockDataLoader.__new__(StockDataLoader)
+        loader.session = session
+        loader.db = session
+        loader.df = df
+
+        print(f"{len(df)} rows per run, {args.runs} runs")
+        for method in ("insert_rows", "copy_rows"):
+            timings = [
+                time_load(loader, method, f"B{run}.{method[:4].upper()}")
+                for run in range(args.runs)
+            ]
+            best = min(timings)
+            print(f"{method:<12} best {best:.3f}s  {len(df) / best:>12,.0f} rows/s")
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare the ORM and the column-projected read path of the period endpoints.
+
+Reads the given symbols over the chosen period from the configured database
+and reports time and peak traced memory per request:
+
+    python -m benchmarks.bench_period_query --period 5y --runs 5 \\
+        --symbols AAPL.US,MSFT.US,NVDA.US
+"""
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from sqlalchemy import select
+
+from db.session import AsyncSession
+from models.stock_data import StockData
+from services.data_version import data_version
+from services.stocks import build_period_query, group_by_symbol, period_mapping
+
+
+async def read_orm(db, period, symbol_list, end_date):
+    start_date = end_date - period_mapping[period]
+    stmt = (
+        select(StockData)
+        .where(
+            StockData.symbol.in_(symbol_list),
+            StockData.date >= start_date,
+            StockData.date <= end_date,
+        )
+        .order_by(StockData.symbol, StockData.date)
+    )
+    return (await db.execute(stmt)).scalars().all()
+
+
+async def read_projected(db, period, symbol_list, end_date):
+    rows = (await db.execute(build_period_query(period, symbol_list, end_date))).all()
+    return group_by_symbol(rows, period)
+
+
+async def measure(read, period, symbol_list, end_date):
+    # A fresh session per request, as the API dependency does
+    async with AsyncSession() as db:
+        tracemalloc.start()
+        start = time.perf_counter()
+        await read(db, period, symbol_list, end_date)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", required=True)
+    parser.add_argument("--period", default="5y", choices=list(period_mapping))
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    symbol_list = [s.strip().upper() for s in args.symbols.split(",")]
+    async with AsyncSession() as db:
+        end_date = await data_version.get_max_date(db)
+
+    print(f"{len(symbol_list)} symbols, {args.period}, {args.runs} runs")
+    for read in (read_orm, read_projected):
+        results = [
+            await measure(read, args.period, symbol_list, end_date)
+            for _ in range(args.runs)
+        ]
+        best = min(elapsed for elapsed, _ in results)
+        peak = max(peak for _, peak in results)
+        print(
+            f"{read.__name__:<15} best {best * 1000:>8.1f}ms  peak {peak / 2**20:>6.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+Anomaly detection over many symbols of 5y daily prices, starting from the
+(dates, Decimal values) columns the database returns. The loop column is the
+previous path: a Decimal list and array per symbol, then a per return Python
+loop. The panel column builds the price panel and runs the vectorized kernel.
+
+    python -m benchmarks.bench_z_score --symbols 100 300 500
+"""
+
+import argparse
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from benchmarks.bench_analytics_fetch import panel_from_columns
+from data.z_score import calc_z_score
+
+# Trading days in 5y
+DAYS = 1260
+
+
+def loop_z_score(numpy_prices_arr, threshold=2.5):
+    results = {}
+    for symbol, prices in numpy_prices_arr.items():
+        returns = np.diff(prices) / prices[:-1]
+        mean_return = np.mean(returns)
+        std_return = np.std(returns)
+
+        stock_anomalies = []
+        for i, daily_ret in enumerate(returns):
+            if std_return == 0:
+                continue
+            z_score = (daily_ret - mean_return) / std_return
+            if abs(z_score) > threshold:
+                stock_anomalies.append(
+                    {
+                        "date_index": i + 1,
+                        "price": prices[i + 1],
+                        "return_pct": round(daily_ret * 100, 2),
+                        "z_score": round(z_score, 2),
+                    }
+                )
+        if stock_anomalies:
+            results[symbol] = stock_anomalies
+    return results
+
+
+def make_prices(symbols: int):
+    rng = np.random.default_rng(symbols)
+    prices = {}
+    for i in range(symbols):
+        returns = rng.standard_t(3, DAYS - 1) * 0.01
+        prices[f"S{i:03d}.US"] = 100 * np.cumprod(np.concatenate([[1.0], 1 + returns]))
+    return prices
+
+
+def make_columns(prices):
+    end = date(2025, 6, 30)
+    dates = [end - timedelta(days=DAYS - 1 - i) for i in range(DAYS)]
+    return {
+        symbol: (dates, [Decimal(f"{value:.2f}") for value in values])
+        for symbol, values in prices.items()
+    }
+
+
+def loop_from_columns(columns):
+    prices = {
+        symbol: np.array(
+            [Decimal(value) for value in values if value is not None],
+            dtype=np.float64,
+        )
+        for symbol, (_, values) in columns.items()
+    }
+    return loop_z_score(prices)
+
+
+def panel_z_score(columns):
+    return calc_z_score(panel_from_columns(columns))
+
+
+def best_ms(runs: int, func, prices) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(prices)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, nargs="+", default=[100, 300, 500])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'symbols':>7} {'anomalies':>9} {'loop':>9} {'panel':>10} {'speedup':>7}")
+    for symbols in args.symbols:
+        prices = make_prices(symbols)
+        columns = make_columns(prices)
+        result = panel_z_score(columns)
+        assert result == loop_from_columns(columns)
+
+        loop_ms = best_ms(args.runs, loop_from_columns, columns)
+        vectorized_ms = best_ms(args.runs, panel_z_score, columns)
+        anomalies = sum(len(found) for found in result.values())
+        print(
+            f"{symbols:>7} {anomalies:>9} {loop_ms:>7.1f}ms {vectorized_ms:>8.1f}ms "
+            f"{loop_ms / vectorized_ms:>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Concurrent load test for the stocks API.
+
+Fires requests at one or more running API instances at increasing concurrency
+levels and reports throughput and latency percentiles, so a sync build and an
+async build can be compared side by side:
+
+    python -m benchmarks.load_test_api \\
+        --base-url http://localhost:8000 --base-url http://localhost:8001 \\
+        --concurrency 1 10 50 --requests 500
+
+Cached responses measure Redis more than the database session. With
+--uncached every request also asks for a symbol of its own that is never
+stored, so no response is served from cache alone: the analytics routes,
+cached per symbol set, are computed from the database on every request and
+the period routes query the database for at least that symbol.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+# Every route moved to the async database session
+DEFAULT_PATHS = [
+    "/api/v1/stocks/anomalies/1y?symbols=AAPL.US,MSFT.US,NVDA.US",
+    "/api/v1/stocks/performance/1y?symbols=AAPL.US,MSFT.US,NVDA.US",
+    "/api/v1/stocks/1y?symbols=AAPL.US,MSFT.US,NVDA.US",
+]
+
+
+def uncached_path(path: str, request: int) -> str:
+    """The path with a symbol no other request asks for and no cache holds."""
+    url = httpx.URL(path)
+    symbols = url.params.get("symbols")
+    unique = f"NC{request}.X"
+    return str(
+        url.copy_set_param("symbols", f"{symbols},{unique}" if symbols else unique)
+    )
+
+
+async def run_level(
+    base_url: str,
+    paths: list[str],
+    concurrency: int,
+    total: int,
+    uncached: bool = False,
+):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        path = paths[i % len(paths)]
+        queue.put_nowait(uncached_path(path, i) if uncached else path)
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        while not queue.empty():
+            path = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "rps": total / elapsed,
+        "p50": quantiles[49] * 1000,
+        "p95": quantiles[94] * 1000,
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", action="append", dest="base_urls")
+    parser.add_argument("--path", action="append", dest="paths")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument(
+        "--uncached",
+        action="store_true",
+        help="Add a unique unknown symbol to every request to bypass the cache",
+    )
+    args = parser.parse_args()
+
+    base_urls = args.base_urls or ["http://localhost:8000"]
+    paths = args.paths or DEFAULT_PATHS
+
+    for base_url in base_urls:
+        print(base_url)
+        for concurrency in args.concurrency:
+            stats = await run_level(
+                base_url, paths, concurrency, args.requests, args.uncached
+            )
+            print(
+                f"  c={concurrency:<4} {stats['rps']:>8.1f} req/s  "
+                f"p50 {stats['p50']:>7.1f}ms  p95 {stats['p95']:>7.1f}ms  "
+                f"errors {stats['errors']}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
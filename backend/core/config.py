@@ -49,6 +49,21 @@ class Settings(BaseSettings):
     REDIS_URL: str = ""
     REDIS_HOST: str = ""
 
+    LOCAL_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    LOCAL_CACHE_TTL: int = 300
+
+    CACHE_LOCK_TTL_MS: int = 5000
+    # Store cached values as compressed columns, smaller but decoded on read
+    CACHE_COMPACT_ENCODING: bool = False
+
+    STOOQ_BASE_URL: str = "https://stooq.com/q/d/l/"
+    INGEST_MAX_DOWNLOADS: int = 4
+    # Symbols loaded at once, each holds a database connection
+    INGEST_MAX_LOADS: int = 4
+    INGEST_CHUNKSIZE: int = 5000
+    # Port the Celery worker serves its metrics on
+    CELERY_METRICS_PORT: int = 9808
+
     @computed_field
     @property
     def SQLALCHEMY_DATABASE_URI(self) -> PostgresDsn:
@@ -61,6 +76,18 @@ class Settings(BaseSettings):
             path=self.POSTGRES_DB,
         )
 
+    @computed_field
+    @property
+    def SQLALCHEMY_ASYNC_DATABASE_URI(self) -> PostgresDsn:
+        return PostgresDsn.build(
+            scheme="postgresql+asyncpg",
+            username=self.POSTGRES_USER,
+            password=self.POSTGRES_PASSWORD,
+            host=self.POSTGRES_SERVER,
+            port=self.POSTGRES_PORT,
+            path=self.POSTGRES_DB,
+        )
+
     TEST_POSTGRES_DB: str = "test_stocks"
     TEST_POSTGRES_SERVER: str = "localhost"
 
@@ -1,5 +1,120 @@
-from prometheus_client import Counter
+import os
+import time
+from contextvars import ContextVar
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
+from prometheus_client import multiprocess
+from sqlalchemy import event
 
 REQUEST_COUNTER = Counter(
     "app_requests_total", "Total number of requests to the app", ["endpoint"]
 )
+
+# Every metric below is broken down by the route being served and its period,
+# work done outside a request is labelled as background
+request_labels: ContextVar[dict[str, str]] = ContextVar(
+    "request_labels", default={"endpoint": "background", "period": ""}
+)
+
+REQUEST_LATENCY = Histogram(
+    "app_request_duration_seconds",
+    "End to end latency of API requests",
+    ["endpoint", "period"],
+)
+
+RESPONSE_SIZE = Histogram(
+    "app_response_size_bytes",
+    "Size of API response bodies",
+    ["endpoint", "period"],
+    buckets=(1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000),
+)
+
+SERIALIZATION_LATENCY = Histogram(
+    "app_serialization_duration_seconds",
+    "Time spent encoding response bodies and cache values",
+    ["endpoint", "period"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+REDIS_LATENCY = Histogram(
+    "redis_command_duration_seconds",
+    "Latency of Redis round trips, pipelines count as one",
+    ["operation", "endpoint", "period"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5),
+)
+
+CACHE_LOOKUPS_COUNTER = Counter(
+    "cache_lookups_total",
+    "Cached keys looked up, by the tier that answered or miss",
+    ["result", "endpoint", "period"],
+)
+
+COALESCED_REQUESTS_COUNTER = Counter(
+    "cache_coalesced_requests_total",
+    "Cache misses served by another request's computation instead of the database",
+    ["scope", "endpoint", "period"],
+)
+
+SQL_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Latency of SQL statements",
+    ["endpoint", "period"],
+)
+
+# Recorded by the Celery worker, one stage at a time
+INGESTION_STAGE_LATENCY = Histogram(
+    "ingestion_stage_duration_seconds",
+    "Time spent in each ingestion stage, per dataset or per run for precache",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+
+def metrics_registry():
+    """
+    Registry to export. With PROMETHEUS_MULTIPROC_DIR set, every process
+    (API worker or Celery child) writes its samples to files there and the
+    registry sums them, so any process can answer a scrape for all of them.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def reset_multiprocess_dir() -> None:
+    """Drop samples left by previous runs, before any process writes new ones."""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        return
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+
+
+def labelled(metric, **labels):
+    """Child of a metric labelled with the current request's endpoint and period."""
+    return metric.labels(**labels, **request_labels.get())
+
+
+def instrument_engine(engine) -> None:
+    """Record the latency of every statement an engine executes."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def observe_query_time(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_time"].pop()
+        labelled(SQL_QUERY_LATENCY).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def drop_query_timer(context):
+        # A failed statement never reaches after_cursor_execute
+        if context.connection is not None:
+            timers = context.connection.info.get("query_start_time")
+            if timers:
+                timers.pop()
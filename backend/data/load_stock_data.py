@@ -1,18 +1,47 @@
+import io
+import time
+import numpy as np
 import pandas as pd
 import uuid
+from bisect import bisect_right
+from collections import defaultdict
+from contextlib import contextmanager
 from decimal import Decimal
 from datetime import datetime
-from sqlalchemy import text, func
+from sqlalchemy import delete, exists, select, text, func
 from sqlalchemy.dialects.postgresql import insert
 
+from core.metrics import INGESTION_STAGE_LATENCY
+from data.z_score import ROLLING_WINDOWS, calc_rolling_z_score
+from models.anomaly import Anomaly
 from models.stock_data import StockData
 from db.session import Session
+from services.data_version import publish_max_date
+
+
+# Columns of the CSV file in the order they are streamed into the staging table
+COPY_COLUMNS = ["Date", "Open", "High", "Low", "Close", "Volume"]
+
+# Bars scored and stored per query while updating anomalies
+ANOMALY_BATCH_BARS = 5000
+
+# Timeframes with a normalized price column
+TIMEFRAMES = ["1mo", "3mo", "6mo", "1y", "5y"]
 
 
 class StockDataLoader:
-    def __init__(self, dataset: str, symbol: str, session=None):
+    def __init__(
+        self,
+        dataset: str,
+        symbol: str,
+        session=None,
+        use_copy=False,
+        incremental=False,
+        chunksize=None,
+    ):
         # Needed for testing on test db session
         self.session = session
+        self.use_copy = use_copy
 
         # Base prices for base100 normalized price calculation for all time horizons
         self.base_price_1mo = Decimal("0.00")
@@ -22,13 +51,341 @@ class StockDataLoader:
         self.base_price_5y = Decimal("0.00")
 
         self.symbol = symbol
-        self.df = pd.read_csv(dataset, parse_dates=["Date"], dayfirst=False)
+
+        # Seconds spent per ingestion stage, observed once the load succeeded
+        self.stage_durations: dict[str, float] = defaultdict(float)
+
+        # All work for the symbol runs on one session in one transaction, so
+        # readers see either the previous or the new data, never a mix.
+        # A provided session gets a savepoint, a failed load then only undoes
+        # its own changes.
+        self.db = session if session else Session()
+        try:
+            with self.db.begin_nested() if session else self.db.begin():
+                self.load(dataset, incremental, chunksize)
+            if session:
+                session.commit()
+        finally:
+            if not session:
+                self.db.close()
+
+        for stage, seconds in self.stage_durations.items():
+            INGESTION_STAGE_LATENCY.labels(stage=stage).observe(seconds)
+
+        # A provided session may still belong to an outer transaction, its
+        # owner publishes once that commits
+        if not session and self.rows_written:
+            publish_max_date(self.symbol.upper(), self.max_date)
+
+    def load(self, dataset: str, incremental: bool, chunksize: int | None) -> None:
+        # Incremental mode only loads bars newer than the ones already stored
+        previous_max_date = (
+            self.get_max_date(self.symbol.upper()) if incremental else None
+        )
+
+        # Rows of the dataset up to previous_max_date, counted while parsing
+        self.overlap_rows = 0
+        self.overlap_close = None
+
+        # Put historical stock data read from csv file
+        if chunksize:
+            rows_written = self.stream_rows(dataset, chunksize, previous_max_date)
+        else:
+            with self.timed("parse"):
+                self.df = pd.read_csv(dataset, parse_dates=["Date"], dayfirst=False)
+            rows_written = self.write_rows(self.new_rows(self.df, previous_max_date))
+
+        if previous_max_date is not None and self.history_revised(
+            dataset, chunksize, previous_max_date
+        ):
+            # The new bars are already written, the upsert rewrites every bar
+            previous_max_date = None
+            if chunksize:
+                rows_written = self.stream_rows(dataset, chunksize, None)
+            else:
+                rows_written = self.write_rows(self.df)
+
+        self.rows_written = rows_written
+
+        if previous_max_date is None:
+            with self.timed("normalize"):
+                self.normalize_full()
+        elif rows_written == 0:
+            print(f"No new data for {self.symbol}, skipping")
+            self.max_date = previous_max_date
+        else:
+            with self.timed("normalize"):
+                self.normalize_incremental(previous_max_date)
+
+        if previous_max_date is None or rows_written:
+            with self.timed("anomalies"):
+                self.update_anomalies(previous_max_date)
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Add the time spent in the block to the stage total."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_durations[stage] += time.perf_counter() - started
+
+    def normalize_full(self) -> None:
+        """Recompute every normalized price of the symbol."""
+        # Clear normalized prices data from previous day for easier updates
+        self.clear_norm_rows(self.symbol.upper())
+        self.max_date = self.get_max_date(self.symbol.upper())
+
+        # Perform calculations for normalization prices
+        self.update_prices(self.get_base_prices())
+
+        self.calculate_normalized_prices()
+
+    def normalize_incremental(self, previous_max_date) -> None:
+        """
+        Update just the normalized prices affected by bars newer than
+        previous_max_date.
+        """
+        self.max_date = self.get_max_date(self.symbol.upper())
+
+        previous_base_prices = self.get_base_prices(previous_max_date)
+        extracted_base_prices = self.get_base_prices()
+        self.update_prices(extracted_base_prices)
+
+        self.calculate_normalized_prices_incremental(
+            previous_max_date, previous_base_prices, extracted_base_prices
+        )
+
+    def update_anomalies(self, previous_max_date=None) -> None:
+        """
+        Score the bars newer than previous_max_date against every rolling
+        window and store their anomalies. Only the closes of those bars and
+        of the longest window before them are read. A symbol without stored
+        anomalies, such as one loaded before the table existed, is scored
+        from its first bar.
+        """
+        if previous_max_date is not None and not self.db.scalar(
+            select(exists().where(Anomaly.symbol == self.symbol))
+        ):
+            previous_max_date = None
+
+        stored = delete(Anomaly).where(Anomaly.symbol == self.symbol)
+        if previous_max_date is not None:
+            stored = stored.where(Anomaly.date > previous_max_date)
+        self.db.execute(stored)
+
+        # Bars are scored and stored in batches, each read together with the
+        # longest window before it to seed the running sums
+        scored_until = previous_max_date
+        first_bar = None
+        while True:
+            dates, closes = self.db.execute(
+                text(
+                    """
+                    SELECT array_agg("date" ORDER BY "date"),
+                        array_agg(close::float8 ORDER BY "date")
+                    FROM (
+                        SELECT "date", close FROM stock_data
+                        WHERE symbol = :symbol AND "date" >= COALESCE((
+                            SELECT "date" FROM stock_data
+                            WHERE symbol = :symbol AND "date" <= :scored_until
+                            ORDER BY "date" DESC OFFSET :window LIMIT 1
+                        ), '-infinity')
+                        ORDER BY "date"
+                        LIMIT :limit
+                    ) AS bars
+                    """
+                ),
+                {
+                    "symbol": self.symbol,
+                    "scored_until": scored_until,
+                    "window": max(ROLLING_WINDOWS),
+                    "limit": max(ROLLING_WINDOWS) + 1 + ANOMALY_BATCH_BARS,
+                },
+            ).one()
+            if not dates:
+                return
+
+            # Bars up to scored_until only seed the running sums
+            start = 0
+            if scored_until is not None:
+                start = bisect_right(dates, scored_until)
+            if first_bar is None:
+                first_bar = 0
+                if scored_until is not None:
+                    first_bar = self.db.scalar(
+                        select(func.count()).where(
+                            StockData.symbol == self.symbol,
+                            StockData.date < dates[0],
+                        )
+                    )
+
+            self.insert_anomalies(
+                dates, np.array(closes, dtype=np.float64), start, first_bar
+            )
+
+            if len(dates) - start < ANOMALY_BATCH_BARS:
+                return
+            # The next batch is seeded with the tail of this one
+            scored_until = dates[-1]
+            first_bar += len(dates) - min(max(ROLLING_WINDOWS) + 1, len(dates))
+
+    def insert_anomalies(self, dates, closes, start: int, first_bar: int) -> None:
+        """Store the anomalies among the bars from start on."""
+        anomalies = []
+        for window in ROLLING_WINDOWS:
+            bars, returns, z_scores = calc_rolling_z_score(closes, window, start)
+            anomalies.extend(
+                {
+                    "id": uuid.uuid4(),
+                    "symbol": self.symbol,
+                    "window_days": window,
+                    "date": dates[bar],
+                    "bar_index": first_bar + bar,
+                    "daily_return": daily_return,
+                    "z_score": z_score,
+                }
+                for bar, daily_return, z_score in zip(
+                    bars.tolist(), returns.tolist(), z_scores.tolist()
+                )
+            )
+
+        if anomalies:
+            self.db.execute(insert(Anomaly).values(anomalies))
+
+    def history_revised(self, dataset: str, chunksize, previous_max_date) -> bool:
+        """
+        Tell whether the dataset revised the stored history, e.g. after a split
+        adjustment. A revised history cannot be loaded incrementally: the
+        stored closes are upserted with COPY and the symbol is normalized and
+        scored in full instead.
+
+        Only the row count up to previous_max_date and the close on that date
+        are compared. An adjustment changes the latest close as well, so every
+        close is compared only when either of them differs.
+        """
+        stored_rows, stored_close = self.db.execute(
+            text(
+                """
+                SELECT count(*), max(close) FILTER (WHERE "date" = :max_date)
+                FROM stock_data
+                WHERE symbol = :symbol AND "date" <= :max_date
+                """
+            ),
+            {"symbol": self.symbol, "max_date": previous_max_date},
+        ).one()
+        if (
+            stored_rows == self.overlap_rows
+            and self.overlap_close is not None
+            and stored_close == round(Decimal(str(self.overlap_close)), 2)
+        ):
+            return False
+
+        if chunksize:
+            chunks = pd.read_csv(
+                dataset,
+                usecols=["Date", "Close"],
+                parse_dates=["Date"],
+                dayfirst=False,
+                chunksize=chunksize,
+            )
+        else:
+            chunks = [self.df]
+
+        if self.closes_differ(chunks, previous_max_date):
+            print(f"History of {self.symbol} was revised, reloading it in full")
+            self.use_copy = True
+            return True
+        return False
+
+    def closes_differ(self, chunks, previous_max_date) -> bool:
+        """Compare every close of the dataset up to previous_max_date."""
+        for chunk in chunks:
+            overlap = chunk[chunk["Date"] <= pd.Timestamp(previous_max_date)]
+            if overlap.empty:
+                continue
+
+            # Closes are stored rounded to cents, dates missing count as revised
+            if self.db.scalar(
+                text(
+                    """
+                    SELECT EXISTS (
+                        SELECT 1
+                        FROM unnest(CAST(:dates AS date[]), CAST(:closes AS float8[]))
+                            AS c ("date", close)
+                        LEFT JOIN stock_data s
+                            ON s.symbol = :symbol AND s."date" = c."date"
+                        WHERE s.close IS DISTINCT FROM round(c.close::numeric, 2)
+                    )
+                    """
+                ),
+                {
+                    "symbol": self.symbol,
+                    "dates": overlap["Date"].dt.date.tolist(),
+                    "closes": overlap["Close"].tolist(),
+                },
+            ):
+                return True
+        return False
+
+    def new_rows(self, df: pd.DataFrame, previous_max_date) -> pd.DataFrame:
+        if previous_max_date is None:
+            return df
+
+        # Summary of the rows already stored, checked by history_revised
+        max_date = pd.Timestamp(previous_max_date)
+        is_new = df["Date"] > max_date
+        self.overlap_rows += len(df) - int(is_new.sum())
+        at_max_date = df.loc[df["Date"] == max_date, "Close"]
+        if not at_max_date.empty:
+            self.overlap_close = at_max_date.iloc[-1]
+        return df[is_new]
+
+    def write_rows(self, df: pd.DataFrame) -> int:
+        if df.empty:
+            return 0
+
+        with self.timed("insert"):
+            if self.use_copy:
+                self.copy_rows(df)
+            else:
+                self.insert_rows(df)
+        return len(df)
+
+    def stream_rows(self, dataset: str, chunksize: int, previous_max_date) -> int:
+        """
+        Read the csv file in chunks of chunksize rows and write each chunk
+        before reading the next one. Chunks are dropped once written and
+        self.df stays None, so memory does not grow with the length of the
+        history.
+        """
+        self.df = None
+        rows_written = 0
+        reader = pd.read_csv(
+            dataset, parse_dates=["Date"], dayfirst=False, chunksize=chunksize
+        )
+        while True:
+            # Chunks are parsed lazily, time each read separately from its write
+            with self.timed("parse"):
+                chunk = next(reader, None)
+            if chunk is None:
+                break
+
+            rows_written += self.write_rows(self.new_rows(chunk, previous_max_date))
+
+        return rows_written
+
+    def insert_rows(self, df: pd.DataFrame | None = None) -> None:
+        """Insert rows from the dataframe with a single INSERT statement."""
+        if df is None:
+            df = self.df
+
         data_to_insert = []
-        for _, row in self.df.iterrows():
+        for _, row in df.iterrows():
             data_to_insert.append(
                 {
                     "id": uuid.uuid4(),
-                    "symbol": symbol,
+                    "symbol": self.symbol,
                     "date": row["Date"],
                     "open": row["Open"],
                     "high": row["High"],
@@ -38,81 +395,95 @@ class StockDataLoader:
                 }
             )
 
-        # Put historical stock data read from csv file
-        if self.session:
-            # Use provided session (for testing or dependency injection)
-            stmt = insert(StockData).values(data_to_insert)
-            stmt = stmt.on_conflict_do_nothing(constraint="uq_symbol_date")
-            self.session.execute(stmt)
-            self.session.commit()
-        else:
-            # Create and use a new session for production
-            db = Session()
-            try:
-                stmt = insert(StockData).values(data_to_insert)
-                stmt = stmt.on_conflict_do_nothing(constraint="uq_symbol_date")
-                db.execute(stmt)
-                db.commit()
-            except Exception as e:
-                db.rollback()
-                raise
-            finally:
-                db.close()
+        stmt = insert(StockData).values(data_to_insert)
+        stmt = stmt.on_conflict_do_nothing(constraint="uq_symbol_date")
+        self.db.execute(stmt)
 
-        # Clear normalized prices data from previous day for easier updates
-        self.clear_norm_rows(symbol.upper())
-        self.max_date = self.get_max_date(symbol.upper())
+    def copy_rows(self, df: pd.DataFrame | None = None) -> None:
+        """
+        Bulk load rows by streaming the dataframe through COPY into a temporary
+        staging table, then upsert them into stock_data in one statement.
+        """
+        if df is None:
+            df = self.df
 
-        # Perform calculations for normalization prices
-        extracted_base_prices = self.get_base_prices()
-        self.update_prices(extracted_base_prices)
-
-        self.calculate_normalized_prices_for_tf("1mo", self.base_price_1mo, "norm_1mo")
-        self.calculate_normalized_prices_for_tf("3mo", self.base_price_3mo, "norm_3mo")
-        self.calculate_normalized_prices_for_tf("6mo", self.base_price_6mo, "norm_6mo")
-        self.calculate_normalized_prices_for_tf("1y", self.base_price_1y, "norm_1y")
-        self.calculate_normalized_prices_for_tf("5y", self.base_price_5y, "norm_5y")
+        buffer = io.StringIO()
+        df[COPY_COLUMNS].to_csv(
+            buffer, header=False, index=False, date_format="%Y-%m-%d"
+        )
+        buffer.seek(0)
 
-    def clear_norm_rows(self, symbol: str):
-        if self.session:
-            db = self.session
-        else:
-            db = Session()
+        self.db.execute(text("DROP TABLE IF EXISTS stock_data_staging"))
+        self.db.execute(
+            text(
+                """
+                CREATE TEMP TABLE stock_data_staging (
+                    "date" date NOT NULL,
+                    open numeric(12, 2) NOT NULL,
+                    high numeric(12, 2) NOT NULL,
+                    low numeric(12, 2) NOT NULL,
+                    close numeric(12, 2) NOT NULL,
+                    volume bigint NOT NULL
+                ) ON COMMIT DROP
+                """
+            )
+        )
 
+        # COPY is not exposed by SQLAlchemy, use the psycopg2 cursor directly
+        cursor = self.db.connection().connection.cursor()
         try:
-            db.query(StockData).filter(StockData.symbol == symbol).update(
-                {
-                    StockData.norm_1mo: None,
-                    StockData.norm_3mo: None,
-                    StockData.norm_6mo: None,
-                    StockData.norm_1y: None,
-                    StockData.norm_5y: None,
-                },
-                synchronize_session=False,
+            cursor.copy_expert(
+                "COPY stock_data_staging FROM STDIN WITH (FORMAT csv)", buffer
             )
-            db.commit()
         finally:
-            if not self.session:
-                db.close()
+            cursor.close()
 
-    def get_max_date(self, symbol: str):
-        if self.session:
-            db = self.session
-        else:
-            db = Session()
+        self.db.execute(
+            text(
+                """
+                INSERT INTO stock_data
+                    (id, symbol, "date", open, high, low, close, volume, created_at)
+                SELECT gen_random_uuid(), :symbol, "date", open, high, low,
+                    close, volume, now() AT TIME ZONE 'utc'
+                FROM stock_data_staging
+                ON CONFLICT ON CONSTRAINT uq_symbol_date DO UPDATE SET
+                    open = EXCLUDED.open,
+                    high = EXCLUDED.high,
+                    low = EXCLUDED.low,
+                    close = EXCLUDED.close,
+                    volume = EXCLUDED.volume
+                WHERE (stock_data.open, stock_data.high, stock_data.low,
+                    stock_data.close, stock_data.volume)
+                    IS DISTINCT FROM (EXCLUDED.open, EXCLUDED.high,
+                    EXCLUDED.low, EXCLUDED.close, EXCLUDED.volume)
+                """
+            ),
+            {"symbol": self.symbol},
+        )
 
-        try:
-            result = (
-                db.query(func.max(StockData.date))
-                .filter(StockData.symbol == symbol)
-                .scalar()
-            )
-            if result is None:
-                print("Could not get the max date, no data in database")
-            return result
-        finally:
-            if not self.session:
-                db.close()
+    def clear_norm_rows(self, symbol: str):
+        self.db.query(StockData).filter(StockData.symbol == symbol).update(
+            {
+                StockData.norm_1mo: None,
+                StockData.norm_3mo: None,
+                StockData.norm_6mo: None,
+                StockData.norm_1y: None,
+                StockData.norm_5y: None,
+            },
+            # Keep objects already loaded in the session in sync, nothing is
+            # committed until the whole load finishes
+            synchronize_session="evaluate",
+        )
+
+    def get_max_date(self, symbol: str):
+        result = (
+            self.db.query(func.max(StockData.date))
+            .filter(StockData.symbol == symbol)
+            .scalar()
+        )
+        if result is None:
+            print("Could not get the max date, no data in database")
+        return result
 
     def calculate_lookback_date(self, today_date: datetime, timeframe: str) -> datetime:
         timeframe_map = {
@@ -130,26 +501,55 @@ class StockDataLoader:
 
         return today_date - timeframe_map[timeframe]
 
-    def get_base_prices(self) -> dict[str, Decimal]:
-        """Get base prices for calculating normalized price for each stock."""
-        timeframes = ["1mo", "3mo", "6mo", "1y", "5y"]
+    def base_prices_cte(self, max_date, params: dict) -> str:
+        """
+        CTEs ending in `bases`: the stored close nearest to the lookback date
+        of every timeframe from max_date, on a tie the earlier date wins.
+        Statements that use it divide stored closes by stored closes, so a
+        dataset that differs from the table can never mix into the result.
+        """
+        targets = []
+        for tf in TIMEFRAMES:
+            params[f"target_{tf}"] = self.calculate_lookback_date(
+                pd.Timestamp(max_date), tf
+            ).date()
+            targets.append(f"('{tf}', CAST(:target_{tf} AS date))")
 
-        base_prices = {}
-        for tf in timeframes:
-            target_date = pd.to_datetime(
-                self.calculate_lookback_date(self.max_date, tf)
-            )
-            df_dates = pd.to_datetime(self.df["Date"])
-
-            # Find nearest date
-            self.df["date_diff"] = abs(df_dates - target_date)
-            nearest_idx = self.df["date_diff"].idxmin()
-            self.df.drop("date_diff", axis=1, inplace=True)
+        # The rows on either side of each lookback date, one index probe each
+        return f"""
+            targets (tf, target) AS (VALUES {", ".join(targets)}),
+            bases AS (
+                SELECT t.tf, nearest.close
+                FROM targets t
+                CROSS JOIN LATERAL (
+                    SELECT c.close FROM (
+                        (SELECT "date", close FROM stock_data
+                        WHERE symbol = :symbol AND "date" < t.target
+                        ORDER BY "date" DESC LIMIT 1)
+                        UNION ALL
+                        (SELECT "date", close FROM stock_data
+                        WHERE symbol = :symbol AND "date" >= t.target
+                        ORDER BY "date" LIMIT 1)
+                    ) AS c
+                    ORDER BY abs(c."date" - t.target), c."date"
+                    LIMIT 1
+                ) AS nearest
+            )"""
 
-            price = self.df.loc[nearest_idx, "Close"]
-            base_prices[tf] = Decimal(str(price))
+    def get_base_prices(self, max_date=None) -> dict[str, Decimal]:
+        """Get base prices for calculating normalized price for each stock."""
+        if max_date is None:
+            max_date = self.max_date
 
-        return base_prices
+        params = {"symbol": self.symbol}
+        rows = self.db.execute(
+            text(
+                f"WITH {self.base_prices_cte(max_date, params)} "
+                "SELECT tf, close FROM bases"
+            ),
+            params,
+        ).all()
+        return dict(rows)
 
     def update_prices(self, prices_dict: dict[str, Decimal]) -> None:
         """Pass updated base prices dictionary to update Class base prices"""
@@ -167,54 +567,107 @@ class StockDataLoader:
         normalized_price = (close_price / base_price) * 100
         return normalized_price
 
+    def calculate_normalized_prices(self) -> None:
+        """Compute all normalized price columns for the symbol in one UPDATE."""
+        self.update_normalized_columns({tf: (f"norm_{tf}", None) for tf in TIMEFRAMES})
+
     def calculate_normalized_prices_for_tf(
         self,
         timeframe: str,
         base_price: Decimal,
         column_name: str,
     ) -> None:
-        offset_map = {
-            "1mo": pd.DateOffset(months=1),
-            "3mo": pd.DateOffset(months=3),
-            "6mo": pd.DateOffset(months=6),
-            "1y": pd.DateOffset(years=1),
-            "5y": pd.DateOffset(years=5),
-        }
+        self.update_normalized_columns({timeframe: (column_name, base_price)})
 
-        self.df["Date"] = pd.to_datetime(self.df["Date"])
-        cutoff_date = pd.Timestamp(self.max_date) - offset_map[timeframe]
-        recent_dates = self.df[self.df["Date"] >= cutoff_date]
+    def update_normalized_columns(
+        self, columns: dict[str, tuple[str, Decimal | None]]
+    ) -> None:
+        """
+        Set-based update of normalized prices. Rows inside the timeframe window
+        get close / base_price * 100, rows outside keep their current value.
+        Without a given base price the stored base close is used.
+        """
+        params = {"symbol": self.symbol}
+        assignments = []
+        cutoffs = []
+        for tf, (column_name, base_price) in columns.items():
+            cutoff_date = self.calculate_lookback_date(
+                pd.Timestamp(self.max_date), tf
+            ).date()
+            cutoffs.append(cutoff_date)
+            params[f"cutoff_{tf}"] = cutoff_date
+            if base_price is None:
+                base = f"(SELECT close FROM bases WHERE tf = '{tf}')"
+            else:
+                params[f"base_{tf}"] = base_price
+                base = f":base_{tf}"
+            assignments.append(
+                f"""{column_name} = CASE WHEN "date" >= :cutoff_{tf}
+                    THEN close / {base} * 100 ELSE {column_name} END"""
+            )
 
-        if self.session:
-            db = self.session
-        else:
-            db = Session()
+        params["min_cutoff"] = min(cutoffs)
 
-        try:
-            for _, row in recent_dates.iterrows():
-                close_price = Decimal(str(row["Close"]))
-                normalized_price: Decimal = self.calculate_normalized_price(
-                    base_price, close_price
-                )
-                db.execute(
-                    text(
-                        f"""
-                        UPDATE stock_data
-                        SET {column_name} = :normalized_price
-                        WHERE "date" = :date AND symbol = :symbol
-                        """
-                    ),
-                    {
-                        "normalized_price": normalized_price,
-                        "date": row["Date"],
-                        "symbol": self.symbol,
-                    },
-                )
-            db.commit()
-        except Exception as e:
-            print(f"Error updating database: {e}")
-            db.rollback()
-            raise
-        finally:
-            if not self.session:
-                db.close()
+        self.db.execute(
+            text(
+                f"""
+                WITH {self.base_prices_cte(self.max_date, params)}
+                UPDATE stock_data
+                SET {", ".join(assignments)}
+                WHERE symbol = :symbol AND "date" >= :min_cutoff
+                """
+            ),
+            params,
+        )
+
+    def calculate_normalized_prices_incremental(
+        self,
+        previous_max_date,
+        previous_base_prices: dict[str, Decimal],
+        base_prices: dict[str, Decimal],
+    ) -> None:
+        """
+        Update only the normalized prices that change after new bars arrive.
+        If the base price of a timeframe is unchanged only the new bars are
+        computed, otherwise its whole window is recomputed. Rows that fell out
+        of a window are cleared. The base prices given only pick what to
+        update, the values come from the stored closes.
+        """
+        params = {"symbol": self.symbol, "previous_max_date": previous_max_date}
+        assignments = []
+        conditions = []
+        for tf, base_price in base_prices.items():
+            column_name = f"norm_{tf}"
+            params[f"old_cutoff_{tf}"] = self.calculate_lookback_date(
+                pd.Timestamp(previous_max_date), tf
+            ).date()
+            params[f"cutoff_{tf}"] = self.calculate_lookback_date(
+                pd.Timestamp(self.max_date), tf
+            ).date()
+
+            if base_price == previous_base_prices[tf]:
+                compute = '"date" > :previous_max_date'
+                clear = f'"date" >= :old_cutoff_{tf} AND "date" < :cutoff_{tf}'
+                conditions.append(f"({compute}) OR ({clear})")
+            else:
+                compute = f'"date" >= :cutoff_{tf}'
+                clear = f'"date" >= :old_cutoff_{tf}'
+                conditions.append(clear)
+
+            assignments.append(
+                f"""{column_name} = CASE WHEN {compute}
+                    THEN close / (SELECT close FROM bases WHERE tf = '{tf}') * 100
+                    WHEN {clear} THEN NULL ELSE {column_name} END"""
+            )
+
+        self.db.execute(
+            text(
+                f"""
+                WITH {self.base_prices_cte(self.max_date, params)}
+                UPDATE stock_data
+                SET {", ".join(assignments)}
+                WHERE symbol = :symbol AND ({" OR ".join(conditions)})
+                """
+            ),
+            params,
+        )
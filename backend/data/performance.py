@@ -1,35 +1,36 @@
-from decimal import Decimal
-from typing import List, Dict
+import heapq
+from operator import itemgetter
 
 
-def get_performance_ranking(price_data: Dict[str, List[Decimal]]) -> Dict[str, List]:
+def get_performance_ranking(
+    latest: list[tuple[str, float]],
+    top: int | None = None,
+    bottom: int | None = None,
+) -> dict[str, dict | list[dict]]:
     """
-    Calculates performance % for all stocks and identifies best/worst.
-    Input prices are normalized (start at 100).
+    Calculates performance % from each symbol's latest normalized price
+    (prices start at 100) and identifies best/worst, plus the top and bottom
+    k symbols when asked. Only k entries are kept while scanning, never a
+    sorted copy of the whole universe.
     """
-    ranking = []
-
-    for symbol, prices in price_data.items():
-        if not prices:
-            continue
-
-        latest_price = prices[-1]
-
-        perf_pct = Decimal(latest_price) - Decimal(100.0)
-
-        ranking.append(
-            {
-                "symbol": symbol,
-                "performance_pct": round(perf_pct, 2),
-                "latest_value": Decimal(latest_price),
-            }
-        )
-    ranking.sort(key=lambda x: x["performance_pct"], reverse=True)
-
-    if not ranking:
+    if not latest:
         return {}
 
-    return {
-        "best": ranking[0],
-        "worst": ranking[-1],
-    }
+    value = itemgetter(1)
+    # Ties go to the first symbol for best and the last one for worst
+    best = heapq.nlargest(top or 1, latest, key=value)
+    worst = heapq.nsmallest(bottom or 1, reversed(latest), key=value)
+
+    def entry(symbol: str, latest_value: float) -> dict:
+        return {
+            "symbol": symbol,
+            "performance_pct": round(latest_value - 100, 2),
+            "latest_value": latest_value,
+        }
+
+    result = {"best": entry(*best[0]), "worst": entry(*worst[0])}
+    if top:
+        result["top"] = [entry(*ranked) for ranked in best]
+    if bottom:
+        result["bottom"] = [entry(*ranked) for ranked in worst]
+    return result
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from .load_stock_data import StockDataLoader
+from core.config import settings
+from core.metrics import INGESTION_STAGE_LATENCY
+
+
+def validators_path(save_path: str) -> str:
+    return f"{os.path.splitext(save_path)[0]}.meta.json"
+
+
+def read_validators(save_path: str) -> dict:
+    """Validators stored for a previously downloaded dataset."""
+    meta_path = validators_path(save_path)
+    if not (os.path.exists(save_path) and os.path.exists(meta_path)):
+        return {}
+
+    with open(meta_path) as file:
+        return json.load(file)
+
+
+def write_validators(save_path: str, validators: dict) -> None:
+    with open(validators_path(save_path), "w") as file:
+        json.dump(validators, file)
+
+
+def download_dataset(url, save_path, validators=None, timeout=30) -> dict | None:
+    """
+    Conditionally download a dataset. Returns the new validators (ETag,
+    Last-Modified, sha256 of the payload) or None when the dataset is unchanged,
+    either because the server answered 304 or the payload is byte-identical.
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    response = requests.get(url, headers=headers, timeout=timeout)
+
+    if response.status_code == 304:
+        print(f"Not modified: {save_path}")
+        return None
+
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to download. Status code: {response.status_code}")
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if content_hash == validators.get("sha256"):
+        print(f"Unchanged: {save_path}")
+        return None
+
+    with open(save_path, "wb") as file:
+        file.write(response.content)
+    print(f"Downloaded: {save_path}")
+
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": content_hash,
+    }
+
+
+class IngestionPipeline:
+    """
+    Downloads datasets concurrently and hands each one to a pool of loaders as
+    soon as its download finishes, so downloads overlap with parsing and
+    database loading and up to max_loads symbols load at once. Every load runs
+    in its own session and transaction.
+    A failing symbol is recorded and does not stop the rest of the run.
+    Datasets that did not change since the last successful load are skipped.
+    """
+
+    def __init__(
+        self,
+        symbols: dict[str, str],
+        base_url: str | None = None,
+        dataset_dir: str = "datasets",
+        max_downloads: int = 4,
+        max_loads: int = 4,
+        **loader_kwargs,
+    ):
+        # stock_symbol : dataset_filename
+        self.symbols = symbols
+        self.base_url = base_url or settings.STOOQ_BASE_URL
+        self.dataset_dir = dataset_dir
+        self.max_downloads = max_downloads
+        # A provided session cannot be shared between threads
+        self.max_loads = 1 if loader_kwargs.get("session") else max_loads
+        self.loader_kwargs = loader_kwargs
+
+        self.loaded: list[str] = []
+        self.skipped: list[str] = []
+        self.failed: dict[str, str] = {}
+
+    def dataset_url(self, symbol: str) -> str:
+        return f"{self.base_url}?s={symbol}&i=d"
+
+    def dataset_path(self, filename: str) -> str:
+        return os.path.join(self.dataset_dir, f"{filename}_d.csv")
+
+    def download(self, symbol: str, filename: str) -> tuple[str, dict | None]:
+        path = self.dataset_path(filename)
+        with INGESTION_STAGE_LATENCY.labels(stage="download").time():
+            validators = download_dataset(
+                self.dataset_url(symbol), path, read_validators(path)
+            )
+        return path, validators
+
+    def load(self, symbol: str, path: str) -> None:
+        StockDataLoader(path, symbol.upper(), **self.loader_kwargs)
+
+    def load_dataset(self, symbol: str, path: str, validators: dict) -> None:
+        self.load(symbol, path)
+        # Only remember the payload once it is safely in the database
+        write_validators(path, validators)
+
+    def record_failure(self, symbol: str, error: Exception) -> None:
+        print(f"Failed to ingest {symbol}: {error}")
+        self.failed[symbol] = str(error)
+
+    def run(self) -> dict[str, list | dict]:
+        start_time = time.perf_counter()
+        os.makedirs(self.dataset_dir, exist_ok=True)
+
+        with (
+            ThreadPoolExecutor(max_workers=self.max_downloads) as downloads,
+            ThreadPoolExecutor(max_workers=self.max_loads) as loads,
+        ):
+            download_futures = {
+                downloads.submit(self.download, symbol, filename): symbol
+                for symbol, filename in self.symbols.items()
+            }
+
+            # Load in completion order while remaining downloads keep running
+            load_futures = {}
+            for future in as_completed(download_futures):
+                symbol = download_futures[future]
+                try:
+                    path, validators = future.result()
+                except Exception as e:
+                    self.record_failure(symbol, e)
+                    continue
+
+                if validators is None:
+                    self.skipped.append(symbol)
+                    continue
+                future = loads.submit(self.load_dataset, symbol, path, validators)
+                load_futures[future] = symbol
+
+            for future in as_completed(load_futures):
+                symbol = load_futures[future]
+                try:
+                    future.result()
+                    self.loaded.append(symbol)
+                except Exception as e:
+                    self.record_failure(symbol, e)
+
+        print(
+            f"Ingested {len(self.loaded)}/{len(self.symbols)} symbols, "
+            f"{len(self.skipped)} unchanged, "
+            f"in {time.perf_counter() - start_time:.2f}s"
+        )
+        return {"loaded": self.loaded, "skipped": self.skipped, "failed": self.failed}
@@ -0,0 +1,83 @@
+"""
+Normalized prices of the requested symbols as one dates x symbols matrix,
+built once per request and shared by the analytics.
+"""
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services.stocks import get_stock_arrays_by_period_async
+
+
+class PricePanel:
+    """
+    float64 matrix with one row per trading date, the union of the symbols'
+    dates, and one column per symbol. A symbol without a price on a date
+    holds NaN there. Columns are stored contiguously, so per symbol
+    reductions sum in the same order as they would over the symbol alone.
+    """
+
+    def __init__(
+        self,
+        dates: npt.NDArray[np.datetime64],
+        symbols: list[str],
+        prices: npt.NDArray[np.float64],
+    ):
+        self.dates = dates
+        self.symbols = symbols
+        self.prices = np.asfortranarray(prices)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        symbols: list[str],
+        codes: npt.NDArray[np.intp],
+        days: npt.NDArray[np.int64],
+        values: npt.NDArray[np.float64],
+    ) -> "PricePanel":
+        """
+        Align unordered rows given as symbol index, day since the epoch and
+        value. Symbols without any row are left out.
+        """
+        present, cols = np.unique(codes, return_inverse=True)
+        dates, rows = np.unique(days, return_inverse=True)
+
+        prices = np.full((len(dates), len(present)), np.nan, order="F")
+        prices[rows, cols] = values
+
+        return cls(
+            dates.astype("datetime64[D]"),
+            [symbols[code] for code in present.tolist()],
+            prices,
+        )
+
+    @property
+    def valid(self) -> npt.NDArray[np.bool_]:
+        return ~np.isnan(self.prices)
+
+    def forward_filled(self) -> npt.NDArray[np.float64]:
+        """Each symbol's latest price as of every date, NaN before its first."""
+        rows = np.where(self.valid, np.arange(len(self.dates))[:, None], 0)
+        np.maximum.accumulate(rows, axis=0, out=rows)
+        return self.prices[rows, np.arange(len(self.symbols))]
+
+    def returns(self) -> npt.NDArray[np.float64]:
+        """
+        Return of every price against the symbol's previous price, gaps are
+        skipped. Row i holds the returns of the prices on dates[i + 1].
+        """
+        previous = self.forward_filled()[:-1]
+        return (self.prices[1:] - previous) / previous
+
+    def positions(self) -> npt.NDArray[np.int64]:
+        """Index of each date within its symbol's own prices."""
+        return np.cumsum(self.valid, axis=0) - 1
+
+
+async def load_price_panel(
+    timeframe: str, symbols: str, db: AsyncSession
+) -> PricePanel:
+    return PricePanel.from_arrays(
+        *await get_stock_arrays_by_period_async(timeframe, symbols, db)
+    )
@@ -1,39 +1,62 @@
 from celery import Celery
 from celery.schedules import crontab
-import requests
-import redis
-import json
+from celery.signals import worker_init
+from prometheus_client import start_http_server
 import asyncio
-from fastapi.encoders import jsonable_encoder
 
-from .load_stock_data import StockDataLoader
+from .pipeline import IngestionPipeline
 from core.config import settings
-from api.routes.stocks import get_stock_prices_by_period
-from db.session import Session
-from utils.decorators import redis_client
-from api.routes.stocks import get_stock_prices_by_period
-
-sync_redis = redis.from_url(settings.REDIS_URL)
+from core.metrics import (
+    INGESTION_STAGE_LATENCY,
+    metrics_registry,
+    reset_multiprocess_dir,
+)
+from services.stocks import get_stock_prices_by_period
+from db.engine import async_engine
+from db.session import Session, AsyncSession
+from data.z_score import Z_SCORE_THRESHOLD
+from services.analytics import get_anomalies, get_performance
+from services.data_version import data_version
+from utils.decorators import (
+    analytics_cache_key,
+    cache_client,
+    normalize_symbols,
+    publish_cache_generation,
+    read_cache_generation,
+    redis_client,
+    stock_cache_key,
+    CACHE_INVALIDATION_CHANNEL,
+    CACHE_NEXT_GENERATION_KEY,
+)
+from utils.serialization import encode_analytics, encode_cache_value
 
 app = Celery(broker=settings.CELERY_BROKER_URL)
 app.conf.enable_utc = True
 app.conf.timezone = "UTC"  # type: ignore
 
+# Ingestion pre-warms a new cache generation and switches to it when done,
+# the previous one keeps serving until then and expires by TTL. Without new
+# data the live generation is re-warmed instead.
 app.conf.beat_schedule = {
-    "clear-redis-stock-cache-every-afternoon": {
-        "task": "data.tasks.clear_all_stock_cache",
-        "schedule": crontab(minute=45, hour=17),
-    },
     "download-and-load-stock-data-every-afternoon": {
         "task": "data.tasks.download_and_load_stock_data",
         "schedule": crontab(minute=0, hour=18),
     },
-    "precache-stock-data-of-popular-stocks": {
-        "task": "data.tasks.run_caching_stocks",
-        "schedule": crontab(minute=15, hour=18),
-    },
 }
 
+available_timeframes = ["1mo", "3mo", "6mo", "1y", "5y"]
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """
+    Serve the worker's metrics for Prometheus. Tasks run in pool child
+    processes, so their samples are collected from PROMETHEUS_MULTIPROC_DIR.
+    """
+    reset_multiprocess_dir()
+    start_http_server(settings.CELERY_METRICS_PORT, registry=metrics_registry())
+
+
 # Dictionary of stocks to download the latest dataset
 stock_symbols = {
     # stock_symbol : dataset_filename
@@ -69,37 +92,80 @@ stock_symbols = {
 }
 
 
-@app.task
-def clear_all_stock_cache():
-    sync_redis.flushdb()
-    print("Redis cache fully cleared.")
+def run_async(coro):
+    """
+    Run a coroutine on a fresh event loop. Redis and database connections
+    are bound to the loop, so they are dropped before it closes.
+    """
+
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await cache_client.connection_pool.disconnect()
+            await redis_client.connection_pool.disconnect()
+            await async_engine.dispose()
 
+    return asyncio.run(runner())
 
-def download_dataset(url, save_path):
-    response = requests.get(url)
 
-    if response.status_code == 200:
-        with open(save_path, "wb") as file:
-            file.write(response.content)
-        print(f"Downloaded: {save_path}")
+async def start_new_generation(prewarm: bool = True) -> int | None:
+    """
+    Fill a new cache generation and make it live. A generation whose prewarm
+    failed is not switched to, every request would miss at once.
+    """
+    generation = await cache_client.incr(CACHE_NEXT_GENERATION_KEY)
+    if prewarm:
+        with INGESTION_STAGE_LATENCY.labels(stage="precache").time():
+            prewarmed = await precache_stock_data(generation)
+        if not prewarmed:
+            print(
+                f"Prewarm of cache generation {generation} failed, keeping the live one."
+            )
+            return None
+
+    if await publish_cache_generation(generation):
+        print(f"Cache generation {generation} is live.")
     else:
-        print(f"Failed to download. Status code: {response.status_code}")
+        print(f"Cache generation {generation} is older than the live one.")
+    return generation
+
+
+@app.task
+def clear_all_stock_cache():
+    # Nothing is deleted, entries of the retired generation expire by TTL
+    generation = run_async(start_new_generation(prewarm=False))
+    print(f"Stock cache cleared, now serving empty generation {generation}.")
 
 
 @app.task
 def download_and_load_stock_data():
-    for symbol, filename in stock_symbols.items():
-        # Download latest version of stock data
-        url = f"https://stooq.com/q/d/l/?s={symbol}&i=d"
-        path = f"datasets/{filename}_d.csv"
-        download_dataset(url, path)
-        # Instantiate class responsible for loading historical stock data and calculating normalized price for each stock
-        StockDataLoader(path, symbol.upper())
+    # Download latest versions of stock data concurrently and load each one
+    # (historical data + normalized prices) as soon as it arrives
+    pipeline = IngestionPipeline(
+        stock_symbols,
+        max_downloads=settings.INGEST_MAX_DOWNLOADS,
+        max_loads=settings.INGEST_MAX_LOADS,
+        use_copy=True,
+        incremental=True,
+        chunksize=settings.INGEST_CHUNKSIZE,
+    )
+    result = pipeline.run()
+
+    if result["loaded"]:
+        run_async(start_new_generation())
+    else:
+        # Nothing changed, e.g. on weekends, refresh the live generation
+        # before its entries expire by TTL
+        run_async(precache_stock_data())
+    return result
 
 
-async def precache_stock_data():
+async def precache_stock_data(generation: int | None = None) -> bool:
     """
     Fetches most popular stocks data from DB and forces an update to Redis cache.
+    Writes the live generation unless another one is given.
+    Returns whether every entry was stored.
     """
     # S&P 500 Top 20 stocks by weight
     most_known_stock_symbols = [
@@ -124,39 +190,80 @@ async def precache_stock_data():
         "cost.us",
         "amd.us",
     ]
-    available_timeframes = ["1mo", "3mo", "6mo", "1y", "5y"]
-
     ttl = 86400
     symbols_str = ",".join(most_known_stock_symbols)
 
-    print("Starting stock data precaching...")
+    if generation is None:
+        generation = await read_cache_generation()
+
+    print(f"Starting stock data precaching for generation {generation}...")
 
+    complete = True
     with Session() as db:
         for period in available_timeframes:
             try:
                 # Fetch data directly from db
-                # This returns a dict: { "SYMBOL.COUNTRY": [StockData object, ...] }
+                # This returns a dict: { "SYMBOL.COUNTRY": [record dict, ...] }
                 stock_data_map = get_stock_prices_by_period(period, symbols_str, db)
 
-                # Serialize and store in Redis
-                for symbol, data_objects in stock_data_map.items():
-                    cache_key = f"stock:{period}:{symbol.upper()}"
+                # Serialize and store in Redis, API workers drop their
+                # local copies of the rewritten keys
+                async with cache_client.pipeline(transaction=True) as pipe:
+                    for symbol, records in stock_data_map.items():
+                        cache_key = stock_cache_key(generation, period, symbol.upper())
 
-                    # Serialize data exactly as the decorator does
-                    serialized_data = jsonable_encoder(data_objects)
-                    json_payload = json.dumps(serialized_data)
-
-                    # Set in Redis (async operation)
-                    await redis_client.setex(cache_key, ttl, json_payload)
+                        # Encoded exactly as the decorator does
+                        pipe.setex(cache_key, ttl, encode_cache_value(records))
+                        pipe.publish(CACHE_INVALIDATION_CHANNEL, cache_key)
+                    await pipe.execute()
 
                 print(f"Cached {period} data for {len(stock_data_map)} symbols")
 
             except Exception as e:
                 print(f"Failed to cache timeframe {period}: {str(e)}")
+                complete = False
+
+    if not await precache_analytics(generation, symbols_str, ttl):
+        complete = False
 
     print("Precaching complete.")
+    return complete
+
+
+async def precache_analytics(generation: int, symbols_str: str, ttl: int) -> bool:
+    """
+    Stores anomalies and performance of the symbol set for every timeframe,
+    under the keys the analytics endpoints read. Returns whether all of them
+    were stored.
+    """
+    # Computed with the parameters the endpoints default to
+    analytics = {
+        "anomalies": (get_anomalies, {"threshold": Z_SCORE_THRESHOLD}),
+        "performance": (get_performance, {}),
+    }
+    symbol_list = normalize_symbols(symbols_str)
+    complete = True
+
+    # The worker has no listener for data version changes, reload it
+    data_version.invalidate()
+
+    async with AsyncSession() as db:
+        for period in available_timeframes:
+            for kind, (compute, params) in analytics.items():
+                try:
+                    result = await compute(period, ",".join(symbol_list), db, **params)
+                    cache_key = analytics_cache_key(
+                        generation, kind, period, symbol_list, **params
+                    )
+                    await cache_client.setex(cache_key, ttl, encode_analytics(result))
+                except Exception as e:
+                    print(f"Failed to cache {kind} for timeframe {period}: {str(e)}")
+                    complete = False
+
+        print(f"Cached analytics for {len(available_timeframes)} timeframes")
+    return complete
 
 
 @app.task
 def run_caching_stocks():
-    asyncio.run(precache_stock_data())
+    run_async(precache_stock_data())
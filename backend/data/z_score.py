@@ -1,75 +1,87 @@
 import numpy as np
 import numpy.typing as npt
-from decimal import Decimal
-from typing import List, Dict
-from sqlalchemy.orm import Session
 
-from services.stocks import get_stock_prices_by_period
-from core.config import settings
+from data.price_panel import PricePanel
 
+# Default absolute z-score above which a daily return is an anomaly
+Z_SCORE_THRESHOLD = 2.5
 
-async def extract_normalized_prices(
-    timeframe: str, symbols: str, db: Session
-) -> Dict[str, List[Decimal]]:
 
-    raw_data_models = get_stock_prices_by_period(timeframe, symbols, db)
+def calc_z_score(panel: PricePanel, threshold: float = Z_SCORE_THRESHOLD):
+    """
+    Daily returns whose z-score against the symbol's own mean and standard
+    deviation exceeds the threshold in absolute value. Every symbol's column
+    of the panel is scanned in a single pass.
+    """
+    returns = panel.returns()
+    valid = ~np.isnan(returns)
+    count = valid.sum(axis=0)
 
-    column_name = f"norm_{timeframe}"
-    results = {}
-
-    for symbol, records in raw_data_models.items():
-        price_list = []
-        for record in records:
-            val = getattr(record, column_name, None)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_return = np.where(valid, returns, 0.0).sum(axis=0) / count
+        deviation = np.where(valid, returns - mean_return, 0.0)
+        std_return = np.sqrt((deviation * deviation).sum(axis=0) / count)
+        z_scores = (returns - mean_return) / std_return
 
-            if val is not None:
-                price_list.append(Decimal(val))
+    # Gaps compare as False, flat series have no z-score at all
+    outliers = (np.abs(z_scores) > threshold) & (std_return != 0)
+    # Transposed so anomalies come grouped by symbol, in date order
+    cols, rows = np.nonzero(outliers.T)
+    price_rows = rows + 1
 
-        results[symbol] = price_list
+    results = {}
+    for col, date_index, price, return_pct, z_score in zip(
+        cols.tolist(),
+        panel.positions()[price_rows, cols].tolist(),
+        panel.prices[price_rows, cols].tolist(),
+        np.round(returns[rows, cols] * 100, 2).tolist(),
+        np.round(z_scores[rows, cols], 2).tolist(),
+    ):
+        results.setdefault(panel.symbols[col], []).append(
+            {
+                "date_index": date_index,
+                "price": price,
+                "return_pct": return_pct,
+                "z_score": z_score,
+            }
+        )
 
     return results
 
 
-def prices_to_numpy_arr(price_data: Dict[str, List[Decimal]]) -> Dict[str, npt.NDArray]:
-    parsed_stocks = {}
-
-    for symbol, prices in price_data.items():
-        parsed_stocks[symbol] = np.array(prices, dtype=np.float64)
-
-    return parsed_stocks
-
-
-def calc_z_score(numpy_prices_arr: Dict[str, npt.NDArray[np.object_]]):
-    results = {}
-
-    for symbol, prices in numpy_prices_arr.items():
-        try:
-            returns = np.diff(prices) / prices[:-1]
-            mean_return = np.mean(returns)
-            std_return = np.std(returns)
-
-            stock_anomalies = []
-            for i, daily_ret in enumerate(returns):
-                if std_return == 0:
-                    continue
-
-                z_score = (daily_ret - mean_return) / std_return
-
-                if abs(z_score) > 2.5:
-                    price_index = i + 1
-                    stock_anomalies.append(
-                        {
-                            "date_index": price_index,
-                            "price": prices[price_index],
-                            "return_pct": round(daily_ret * 100, 2),
-                            "z_score": round(z_score, 2),
-                        }
-                    )
-            if stock_anomalies:
-                results[symbol] = stock_anomalies
-
-        except Exception as e:
-            print(f"Error parsing {symbol}: {e}")
-            continue
-
-    return results
+# Trading days of the rolling windows whose anomalies are kept at ingestion
+ROLLING_WINDOWS = (20, 60)
+
+
+def calc_rolling_z_score(
+    prices: npt.NDArray[np.float64],
+    window: int,
+    start: int = 0,
+    threshold: float = Z_SCORE_THRESHOLD,
+):
+    """
+    Anomalies of one symbol's prices, each daily return scored against the
+    mean and standard deviation of the `window` returns before it. Running
+    sums of the returns and their squares give every window's statistics in
+    constant time, so only the bars from `start` on are scored and earlier
+    prices merely seed the sums.
+
+    Returns the price index, return and z-score of every anomaly.
+    """
+    returns = (prices[1:] - prices[:-1]) / prices[:-1]
+    sums = np.concatenate(([0.0], np.cumsum(returns)))
+    squares = np.concatenate(([0.0], np.cumsum(returns * returns)))
+
+    # Return i belongs to price i + 1 and needs `window` returns before it
+    scored = np.arange(max(window, start - 1), len(returns))
+    mean = (sums[scored] - sums[scored - window]) / window
+    variance = (squares[scored] - squares[scored - window]) / window - mean * mean
+    std = np.sqrt(np.maximum(variance, 0.0))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_scores = (returns[scored] - mean) / std
+
+    # A flat window has no z-score at all
+    outliers = (np.abs(z_scores) > threshold) & (std > 0)
+    found = scored[outliers]
+    return found + 1, returns[found], z_scores[outliers]
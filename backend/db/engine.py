@@ -1,4 +1,12 @@
 from core.config import settings
+from core.metrics import instrument_engine
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 
 engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+
+# Used by API routes so database waits do not block the event loop
+async_engine = create_async_engine(str(settings.SQLALCHEMY_ASYNC_DATABASE_URI))
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
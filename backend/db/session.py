@@ -1,8 +1,11 @@
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from db.engine import engine
+from db.engine import engine, async_engine
 
 Session = sessionmaker(bind=engine, expire_on_commit=False)
 
+AsyncSession = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
 
 def get_db():
     """Dependency for getting database session."""
@@ -12,3 +15,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Dependency for getting async database session."""
+    async with AsyncSession() as db:
+        yield db
@@ -5,4 +5,10 @@ set -e
 alembic upgrade head 
 echo "Migrations complete. Starting application server..."
 
+# Start from empty metrics, files of the previous run's workers would be summed in
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 exec fastapi run --port 8000 --workers 2 main.py
@@ -1,25 +1,45 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.routing import APIRoute
 from core.config import settings
 from api.main import api_router
 from starlette.middleware.cors import CORSMiddleware
 from prometheus_client import make_asgi_app
 from fastapi.responses import ORJSONResponse
+from core.metrics import REQUEST_LATENCY, RESPONSE_SIZE, metrics_registry
+from services.data_version import data_version
+from utils.decorators import listen_for_cache_invalidations
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
     return f"{route.tags[0]}-{route.name}"
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep the in-process data version and cache in sync with the tasks
+    listeners = [
+        asyncio.create_task(data_version.listen()),
+        asyncio.create_task(listen_for_cache_invalidations()),
+    ]
+    yield
+    for listener in listeners:
+        listener.cancel()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
     default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
-metrics_app = make_asgi_app()
-# Prometheus metrics ep
+# Prometheus metrics ep, summed over all API workers in multiprocess mode
+metrics_app = make_asgi_app(registry=metrics_registry())
 app.mount("/metrics", metrics_app)
 
 if settings.all_cors_origins:
@@ -32,3 +52,18 @@ if settings.all_cors_origins:
     )
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+
+    # Set by the API router, other paths such as /metrics are not recorded
+    labels = getattr(request.state, "metric_labels", None)
+    if labels is not None:
+        REQUEST_LATENCY.labels(**labels).observe(time.perf_counter() - started)
+        RESPONSE_SIZE.labels(**labels).observe(
+            int(response.headers.get("content-length", 0))
+        )
+    return response
@@ -1,4 +1,5 @@
 from models.base import Base
+from models.anomaly import Anomaly
 from models.stock_data import StockData
 
-__all__ = ["Base", "StockData"]
+__all__ = ["Anomaly", "Base", "StockData"]
@@ -0,0 +1,36 @@
+import uuid
+from datetime import date
+
+from sqlalchemy import VARCHAR, Date, Double, Integer, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from models.base import Base
+
+
+class Anomaly(Base):
+    """
+    Daily return whose z-score against the rolling window of returns before
+    it exceeds the anomaly threshold, kept up to date at ingestion.
+    """
+
+    __tablename__ = "anomalies"
+
+    id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+    )
+    symbol: Mapped[str] = mapped_column(VARCHAR(10), nullable=False)
+    # Trading days of returns the mean and standard deviation are taken over
+    window_days: Mapped[int] = mapped_column(Integer, nullable=False)
+    date: Mapped[date] = mapped_column(Date, nullable=False)
+    # Position of the bar among all of the symbol's bars, from its first
+    bar_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    daily_return: Mapped[float] = mapped_column(Double, nullable=False)
+    z_score: Mapped[float] = mapped_column(Double, nullable=False)
+
+    __table_args__ = (
+        # Also serves the endpoint's lookup by symbol, window and date range
+        UniqueConstraint(
+            "symbol", "window_days", "date", name="uq_anomaly_symbol_window_date"
+        ),
+    )
@@ -0,0 +1,77 @@
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.performance import get_performance_ranking
+from data.price_panel import load_price_panel
+from data.z_score import ROLLING_WINDOWS, Z_SCORE_THRESHOLD, calc_z_score
+from services.stocks import (
+    get_latest_values_by_period_async,
+    get_rolling_anomalies_by_period_async,
+)
+
+
+async def get_anomalies(
+    timeframe: str,
+    symbols: str,
+    db: AsyncSession,
+    threshold: float = Z_SCORE_THRESHOLD,
+    window: int | None = None,
+):
+    """
+    Daily returns of each symbol with an absolute z-score above the threshold.
+    Without a window returns are scored against the whole timeframe, with one
+    against the window of returns before them, as stored at ingestion.
+    """
+    if window is not None:
+        return await get_rolling_anomalies(timeframe, symbols, db, threshold, window)
+
+    panel = await load_price_panel(timeframe, symbols, db)
+    return calc_z_score(panel, threshold)
+
+
+async def get_rolling_anomalies(
+    timeframe: str, symbols: str, db: AsyncSession, threshold: float, window: int
+):
+    if window not in ROLLING_WINDOWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid window. Must be one of: {', '.join(map(str, ROLLING_WINDOWS))}",
+        )
+    # Only returns above the default threshold are stored
+    if threshold < Z_SCORE_THRESHOLD:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Rolling anomalies need a threshold of at least {Z_SCORE_THRESHOLD}",
+        )
+
+    rows = await get_rolling_anomalies_by_period_async(
+        timeframe, symbols, window, threshold, db
+    )
+
+    results = {}
+    for symbol, date_index, price, daily_return, z_score in rows:
+        results.setdefault(symbol, []).append(
+            {
+                "date_index": date_index,
+                "price": price,
+                "return_pct": round(daily_return * 100, 2),
+                "z_score": round(z_score, 2),
+            }
+        )
+
+    return results
+
+
+async def get_performance(
+    timeframe: str,
+    symbols: str | None,
+    db: AsyncSession,
+    top: int | None = None,
+    bottom: int | None = None,
+):
+    """
+    Best and worst performing symbols for the given timeframe, every stored
+    symbol is ranked when none are given.
+    """
+    latest = await get_latest_values_by_period_async(timeframe, symbols, db)
+    return get_performance_ranking(latest, top, bottom)
@@ -0,0 +1,132 @@
+"""
+Latest trading dates of the stored stock data, globally and per symbol.
+
+Ingestion writes the dates to Redis once its transaction has committed and
+announces the change on a pub/sub channel. API processes keep the dates in
+memory and drop their copy when an announcement arrives, so requests never
+have to run MAX(date) over stock_data.
+"""
+
+import asyncio
+from datetime import date
+
+import redis
+from redis.exceptions import RedisError
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from models.stock_data import StockData
+from utils.decorators import redis_client
+
+SYMBOL_DATES_KEY = "data_version:symbols"
+# Set when the hash was rebuilt from the database. Publishing a date after a
+# Redis restart creates the hash with that symbol only, which lacks the marker.
+COMPLETE_FIELD = "_complete"
+CHANNEL = "data_version"
+
+
+# Ingestion publishes once per loaded symbol, all over one connection pool
+publish_client: redis.Redis | None = None
+
+
+def get_publish_client() -> redis.Redis:
+    global publish_client
+    if publish_client is None:
+        publish_client = redis.from_url(settings.REDIS_URL, socket_connect_timeout=1)
+    return publish_client
+
+
+def publish_max_date(symbol: str, max_date: date) -> None:
+    """
+    Store the latest date of a symbol and notify API processes.
+    The database stays the source of truth, an unreachable Redis is only reported.
+    """
+    try:
+        with get_publish_client().pipeline() as pipe:
+            pipe.hset(SYMBOL_DATES_KEY, symbol, max_date.isoformat())
+            pipe.publish(CHANNEL, symbol)
+            pipe.execute()
+    except (RedisError, ValueError) as e:
+        print(f"Could not publish data version for {symbol}: {e}")
+
+
+class DataVersion:
+    """In-process copy of the latest dates, reloaded after every invalidation."""
+
+    def __init__(self, client=redis_client):
+        self.client = client
+        self.symbol_dates: dict[str, date] | None = None
+
+    async def load(self, db: AsyncSession) -> dict[str, date]:
+        try:
+            stored = await self.client.hgetall(SYMBOL_DATES_KEY)
+        except RedisError as e:
+            # Without Redis there is no invalidation, so nothing is kept
+            print(f"Could not read data version: {e}")
+            return await self.query_symbol_dates(db)
+
+        if COMPLETE_FIELD in stored:
+            symbol_dates = {
+                s: date.fromisoformat(d)
+                for s, d in stored.items()
+                if s != COMPLETE_FIELD
+            }
+        else:
+            # Cold or partial Redis, rebuild the version from the database once
+            symbol_dates = await self.query_symbol_dates(db)
+            if symbol_dates:
+                await self.client.hset(
+                    SYMBOL_DATES_KEY,
+                    mapping={
+                        **{s: d.isoformat() for s, d in symbol_dates.items()},
+                        COMPLETE_FIELD: "1",
+                    },
+                )
+
+        self.symbol_dates = symbol_dates
+        return symbol_dates
+
+    async def query_symbol_dates(self, db: AsyncSession) -> dict[str, date]:
+        stmt = select(StockData.symbol, func.max(StockData.date)).group_by(
+            StockData.symbol
+        )
+        return dict((await db.execute(stmt)).all())
+
+    async def get_symbol_dates(self, db: AsyncSession) -> dict[str, date]:
+        if self.symbol_dates is None:
+            return await self.load(db)
+        return self.symbol_dates
+
+    async def get_max_date(self, db: AsyncSession) -> date | None:
+        """Latest date across all symbols."""
+        symbol_dates = await self.get_symbol_dates(db)
+        if not symbol_dates:
+            print("Could not get the max date")
+            return None
+        return max(symbol_dates.values())
+
+    async def get_symbol_max_date(self, symbol: str, db: AsyncSession) -> date | None:
+        return (await self.get_symbol_dates(db)).get(symbol)
+
+    def invalidate(self) -> None:
+        self.symbol_dates = None
+
+    async def listen(self) -> None:
+        """Drop the in-process copy whenever ingestion publishes a new version."""
+        while True:
+            try:
+                async with self.client.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    # Announcements may have been missed while disconnected
+                    self.invalidate()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.invalidate()
+            except RedisError as e:
+                print(f"Data version listener disconnected: {e}")
+                self.invalidate()
+                await asyncio.sleep(5)
+
+
+data_version = DataVersion()
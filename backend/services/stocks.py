@@ -1,12 +1,27 @@
+import time
+
+import numpy as np
 from fastapi import status, HTTPException
-from sqlalchemy import select
+from sqlalchemy import Double, cast, select, text
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dateutil.relativedelta import relativedelta
 from sqlalchemy import func
 from collections import defaultdict
 
+from core.metrics import SQL_QUERY_LATENCY, labelled
+from models.anomaly import Anomaly
 from models.stock_data import StockData
 from db.session import Session as s
+from services.data_version import data_version
+
+period_mapping = {
+    "1mo": relativedelta(months=1),
+    "3mo": relativedelta(months=3),
+    "6mo": relativedelta(months=6),
+    "1y": relativedelta(years=1),
+    "5y": relativedelta(years=5),
+}
 
 
 def get_max_date():
@@ -20,29 +35,18 @@ def get_max_date():
         return result
 
 
-def get_stock_prices_by_period(
-    period: str,
-    symbols: str,
-    db: Session,
-):
-    """
-    Method for getting stock data for specified symbol/s
-    from pre-defined periods (1mo, 3mo, etc.)
-    """
-    period_mapping = {
-        "1mo": relativedelta(months=1),
-        "3mo": relativedelta(months=3),
-        "6mo": relativedelta(months=6),
-        "1y": relativedelta(years=1),
-        "5y": relativedelta(years=5),
-    }
-
+def validate_period(period: str) -> None:
     if period not in period_mapping:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Invalid period. Must be one of: {', '.join(period_mapping.keys())}",
         )
 
+
+def parse_period_request(period: str, symbols: str) -> list[str]:
+    """Validate period and return the requested symbols normalized."""
+    validate_period(period)
+
     symbol_list = [s.strip().upper() for s in symbols.split(",")]
 
     if not symbol_list:
@@ -51,12 +55,17 @@ def get_stock_prices_by_period(
             detail="At least one symbol must be provided",
         )
 
-    end_date = get_max_date()
-    delta = period_mapping[period]
-    start_date = end_date - delta
+    return symbol_list
+
+
+def build_period_query(period: str, symbol_list: list[str], end_date):
+    start_date = end_date - period_mapping[period]
 
-    stmt = (
-        select(StockData)
+    norm_column = getattr(StockData, f"norm_{period}")
+
+    # Only the columns the period responses carry, as plain rows
+    return (
+        select(StockData.symbol, StockData.date, norm_column)
         .where(
             StockData.symbol.in_(symbol_list),
             StockData.date >= start_date,
@@ -65,10 +74,261 @@ def get_stock_prices_by_period(
         .order_by(StockData.symbol, StockData.date)
     )
 
-    stock_data = db.execute(stmt).scalars().all()
 
+def group_by_symbol(rows, period: str):
+    """Group (symbol, date, norm) rows into response records per symbol."""
+    column = f"norm_{period}"
     result = defaultdict(list)
-    for data in stock_data:
-        result[data.symbol].append(data)
+    for symbol, day, norm in rows:
+        result[symbol].append({"symbol": symbol, "date": day, column: norm})
 
     return result
+
+
+def get_stock_prices_by_period(
+    period: str,
+    symbols: str,
+    db: Session,
+):
+    """
+    Method for getting stock data for specified symbol/s
+    from pre-defined periods (1mo, 3mo, etc.)
+    """
+    symbol_list = parse_period_request(period, symbols)
+
+    stmt = build_period_query(period, symbol_list, get_max_date())
+    rows = db.execute(stmt).all()
+
+    return group_by_symbol(rows, period)
+
+
+async def get_stock_prices_by_period_async(
+    period: str,
+    symbols: str,
+    db: AsyncSession,
+):
+    """
+    Async version of get_stock_prices_by_period, every query runs on the
+    request's async session without blocking the event loop.
+    """
+    symbol_list = parse_period_request(period, symbols)
+
+    stmt = build_period_query(period, symbol_list, await data_version.get_max_date(db))
+    rows = (await db.execute(stmt)).all()
+
+    return group_by_symbol(rows, period)
+
+
+def build_period_copy(period: str) -> str:
+    """
+    Query to COPY in binary format: every (symbol, date, normalized price)
+    of the requested symbols, with the symbol as its 1-based position in the
+    requested list, the date as days since the epoch and missing prices as
+    NaN. Rows come in no particular order, the caller places each one by its
+    symbol and date.
+    """
+    return f"""
+        SELECT s.ord::int4,
+               (d.date - DATE '1970-01-01')::int4,
+               COALESCE(d.norm_{period}::float8, 'NaN')
+        FROM unnest($1::text[]) WITH ORDINALITY AS s(symbol, ord)
+        JOIN stock_data d ON d.symbol = s.symbol
+        WHERE d.date >= $2 AND d.date <= $3
+    """
+
+
+# Every row of the COPY: field count, then length and value of the 3 fields
+PERIOD_COPY_ROW = np.dtype(
+    [
+        ("fields", ">i2"),
+        ("ord_len", ">i4"),
+        ("ord", ">i4"),
+        ("day_len", ">i4"),
+        ("day", ">i4"),
+        ("norm_len", ">i4"),
+        ("norm", ">f8"),
+    ]
+)
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+def parse_period_copy(data: bytes):
+    """Split a binary COPY of build_period_copy into ord, day and norm arrays."""
+    if not data:
+        empty = np.empty(0, dtype=PERIOD_COPY_ROW)
+        return empty["ord"], empty["day"], empty["norm"]
+    if not data.startswith(COPY_SIGNATURE):
+        raise ValueError("Not a binary COPY stream")
+
+    # Signature, flags and the length of the header extension to skip
+    header = len(COPY_SIGNATURE) + 8 + int.from_bytes(data[15:19], "big")
+    body = memoryview(data)[header:-2]
+    if len(body) % PERIOD_COPY_ROW.itemsize:
+        raise ValueError("Unexpected binary COPY row layout")
+
+    rows = np.frombuffer(body, dtype=PERIOD_COPY_ROW)
+    return (
+        rows["ord"].astype(np.intp),
+        rows["day"].astype(np.int64),
+        rows["norm"].astype(np.float64),
+    )
+
+
+async def get_stock_arrays_by_period_async(
+    period: str,
+    symbols: str,
+    db: AsyncSession,
+):
+    """
+    Same selection as get_stock_prices_by_period_async for the analytics:
+    the sorted symbols, then the symbol index, day since the epoch and
+    normalized price of every row as NumPy arrays. The rows are copied in
+    PostgreSQL's binary format straight into the arrays, so no Decimal or
+    per row Python object is ever built.
+    """
+    symbol_list = sorted(set(parse_period_request(period, symbols)))
+    end_date = await data_version.get_max_date(db)
+    if end_date is None:
+        return symbol_list, *parse_period_copy(b"")
+    start_date = end_date - period_mapping[period]
+
+    # COPY needs the asyncpg connection under the session's transaction
+    connection = await (await db.connection()).get_raw_connection()
+    chunks = []
+
+    async def collect(chunk: bytes) -> None:
+        chunks.append(chunk)
+
+    # The raw driver bypasses the engine events that time statements
+    started = time.perf_counter()
+    await connection.driver_connection.copy_from_query(
+        build_period_copy(period),
+        symbol_list,
+        start_date,
+        end_date,
+        output=collect,
+        format="binary",
+    )
+    labelled(SQL_QUERY_LATENCY).observe(time.perf_counter() - started)
+
+    codes, days, values = parse_period_copy(b"".join(chunks))
+    return symbol_list, codes - 1, days, values
+
+
+def build_rolling_anomalies_query(
+    period: str, symbol_list: list[str], window: int, threshold: float, end_date
+):
+    start_date = end_date - period_mapping[period]
+    norm_column = getattr(StockData, f"norm_{period}")
+
+    # Bars of each symbol before the period, the position of an anomaly among
+    # the period's prices, as the period endpoints return them, is its bar
+    # index less these
+    earlier = (
+        select(StockData.symbol, func.count().label("bars"))
+        .where(StockData.symbol.in_(symbol_list), StockData.date < start_date)
+        .group_by(StockData.symbol)
+        .subquery()
+    )
+
+    return (
+        select(
+            Anomaly.symbol,
+            Anomaly.bar_index - func.coalesce(earlier.c.bars, 0),
+            cast(norm_column, Double),
+            Anomaly.daily_return,
+            Anomaly.z_score,
+        )
+        .join(
+            StockData,
+            (StockData.symbol == Anomaly.symbol) & (StockData.date == Anomaly.date),
+        )
+        .outerjoin(earlier, earlier.c.symbol == Anomaly.symbol)
+        .where(
+            Anomaly.symbol.in_(symbol_list),
+            Anomaly.window_days == window,
+            Anomaly.date >= start_date,
+            Anomaly.date <= end_date,
+            func.abs(Anomaly.z_score) > threshold,
+            norm_column.is_not(None),
+        )
+        .order_by(Anomaly.symbol, Anomaly.date)
+    )
+
+
+async def get_rolling_anomalies_by_period_async(
+    period: str,
+    symbols: str,
+    window: int,
+    threshold: float,
+    db: AsyncSession,
+):
+    """
+    Stored rolling window anomalies of the period as (symbol, date index,
+    normalized price, return, z-score) rows, read through the anomalies
+    index instead of scoring the prices again.
+    """
+    symbol_list = parse_period_request(period, symbols)
+
+    end_date = await data_version.get_max_date(db)
+    if end_date is None:
+        return []
+
+    stmt = build_rolling_anomalies_query(
+        period, symbol_list, window, threshold, end_date
+    )
+    return (await db.execute(stmt)).all()
+
+
+def build_latest_values_query(period: str):
+    """
+    Latest normalized price of the period for each symbol of :symbols, in
+    their order. Every symbol costs one backward probe of its (symbol, date)
+    index, symbols without a price in the period are left out.
+    """
+    return text(
+        f"""
+        SELECT s.symbol, latest.norm
+        FROM unnest(CAST(:symbols AS text[])) WITH ORDINALITY AS s(symbol, ord)
+        CROSS JOIN LATERAL (
+            SELECT d.norm_{period}::float8 AS norm
+            FROM stock_data d
+            WHERE d.symbol = s.symbol
+                AND d.date >= :start_date AND d.date <= :end_date
+                AND d.norm_{period} IS NOT NULL
+            ORDER BY d.date DESC
+            LIMIT 1
+        ) AS latest
+        ORDER BY s.ord
+        """
+    )
+
+
+async def get_latest_values_by_period_async(
+    period: str,
+    symbols: str | None,
+    db: AsyncSession,
+) -> list[tuple[str, float]]:
+    """
+    (symbol, latest normalized price) of the sorted symbols, or of every
+    stored symbol when none are given.
+    """
+    if symbols is None:
+        validate_period(period)
+        symbol_list = sorted(await data_version.get_symbol_dates(db))
+    else:
+        symbol_list = sorted(set(parse_period_request(period, symbols)))
+
+    end_date = await data_version.get_max_date(db)
+    if end_date is None:
+        return []
+
+    rows = await db.execute(
+        build_latest_values_query(period),
+        {
+            "symbols": symbol_list,
+            "start_date": end_date - period_mapping[period],
+            "end_date": end_date,
+        },
+    )
+    return [tuple(row) for row in rows]
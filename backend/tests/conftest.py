@@ -1,13 +1,16 @@
+import asyncio
 import pytest
 from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from models.stock_data import StockData
 from core.config import settings
 from data.load_stock_data import StockDataLoader
+from services.data_version import DataVersion
 
 import pandas as pd
 import tempfile
-from datetime import date
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 
@@ -72,6 +75,66 @@ def db_session(test_db_engine):
     connection.close()
 
 
+@pytest.fixture
+def run_with_async_db(test_db_engine):
+    """Run an async function with an async session inside a rolled back transaction"""
+    url = test_db_engine.url.set(drivername="postgresql+asyncpg")
+
+    def run(func):
+        async def runner():
+            engine = create_async_engine(url)
+            try:
+                async with engine.connect() as connection:
+                    transaction = await connection.begin()
+                    session = AsyncSession(bind=connection, expire_on_commit=False)
+                    try:
+                        return await func(session)
+                    finally:
+                        await session.close()
+                        await transaction.rollback()
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(runner())
+
+    return run
+
+
+@pytest.fixture
+def make_rows():
+    """Factory of a symbol's daily rows ending on the given date"""
+
+    def make(symbol, days, end=date(2025, 6, 30)):
+        return [
+            StockData(
+                symbol=symbol,
+                date=end - timedelta(days=i),
+                open=Decimal("100.00"),
+                high=Decimal("101.00"),
+                low=Decimal("99.00"),
+                close=Decimal("100.50"),
+                volume=1000,
+                norm_1mo=Decimal("100.00"),
+                # asyncpg rejects the model's tz-aware default for a naive column
+                created_at=datetime(2025, 6, 30),
+            )
+            for i in range(days)
+        ]
+
+    return make
+
+
+@pytest.fixture
+def data_version(mocker):
+    """Fresh data version backed by an empty mocked Redis"""
+    client = mocker.Mock()
+    client.hgetall = mocker.AsyncMock(return_value={})
+    client.hset = mocker.AsyncMock()
+    version = DataVersion(client=client)
+    mocker.patch("services.stocks.data_version", version)
+    return version
+
+
 @pytest.fixture
 def sample_stock_data():
     return [
@@ -0,0 +1,538 @@
+import asyncio
+import time
+from datetime import date
+from decimal import Decimal
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+from prometheus_client import REGISTRY
+
+from api.routes.stocks import get_stock_anomalies
+from schemas.stock_data import Stock1MoResponse
+from utils import decorators
+from utils.decorators import (
+    cache_analytics,
+    cache_stock_data,
+    get_cache_generation,
+    inflight,
+    invalidate_local_cache,
+    local_cache,
+    publish_cache_generation,
+)
+from core.config import settings
+from core.metrics import request_labels
+from utils.serialization import (
+    decode_cache_value,
+    encode_compact,
+    encode_records,
+)
+
+
+@pytest.fixture
+def cache_redis(mocker):
+    client = mocker.patch("utils.decorators.cache_client")
+    client.mget = mocker.AsyncMock()
+    client.pipeline = mocker.MagicMock()
+    pipe = mocker.MagicMock()
+    # Every lock is acquired unless a test says otherwise
+    pipe.execute = mocker.AsyncMock(return_value=[True] * 10)
+    client.pipeline.return_value.__aenter__.return_value = pipe
+    client.delete = mocker.AsyncMock()
+    client.get = mocker.AsyncMock(return_value=b"7")
+    mocker.patch("utils.decorators.cached_generation", None)
+    local_cache.clear()
+    yield client, pipe
+    local_cache.clear()
+
+
+def make_endpoint(calls, delay=0):
+    @cache_stock_data(ttl=60)
+    async def get_stocks_1mo(symbols, db):
+        calls.append(symbols)
+        await asyncio.sleep(delay)
+        return {
+            symbol: [
+                {
+                    "symbol": symbol,
+                    "date": date(2025, 6, 30),
+                    "norm_1mo": Decimal("100.00"),
+                }
+            ]
+            for symbol in symbols.split(",")
+        }
+
+    return get_stocks_1mo
+
+
+def call(endpoint, symbols):
+    response = asyncio.run(endpoint(symbols, None))
+    return orjson.loads(response.body)
+
+
+def cached_records(symbol):
+    return [{"symbol": symbol, "date": "2025-06-30T00:00:00", "norm_1mo": "100.00"}]
+
+
+def test_cache_reads_all_symbols_with_one_mget(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [
+        orjson.dumps(cached_records("AAA.US")),
+        orjson.dumps(cached_records("BBB.US")),
+    ]
+    calls = []
+
+    response = asyncio.run(make_endpoint(calls)("bbb.us,AAA.US", None))
+
+    client.mget.assert_awaited_once_with(["stock:7:1mo:AAA.US", "stock:7:1mo:BBB.US"])
+    assert calls == []
+    pipe.setex.assert_not_called()
+    assert response.media_type == "application/json"
+    assert orjson.loads(response.body) == {
+        "AAA.US": cached_records("AAA.US"),
+        "BBB.US": cached_records("BBB.US"),
+    }
+
+
+def test_cache_keys_normalized_symbols(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [orjson.dumps(cached_records("AAA.US"))]
+
+    result = call(make_endpoint([]), "aaa.us, AAA.US,")
+
+    # Duplicates and blank entries are dropped, as for the analytics routes
+    client.mget.assert_awaited_once_with(["stock:7:1mo:AAA.US"])
+    assert result == {"AAA.US": cached_records("AAA.US")}
+
+
+@pytest.mark.parametrize("symbols", ["", " , "])
+def test_cache_rejects_blank_symbols(cache_redis, symbols):
+    client, pipe = cache_redis
+    calls = []
+
+    with pytest.raises(HTTPException) as exc_info:
+        call(make_endpoint(calls), symbols)
+
+    assert exc_info.value.status_code == 400
+    assert calls == []
+    client.mget.assert_not_awaited()
+
+
+def test_cache_writes_misses_in_one_pipeline(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [orjson.dumps(cached_records("AAA.US")), None, None]
+    calls = []
+
+    result = call(make_endpoint(calls), "AAA.US,BBB.US,CCC.US")
+
+    assert calls == ["BBB.US,CCC.US"]
+    # One pipeline for the locks, one transaction for the writes
+    assert client.pipeline.call_count == 2
+    client.pipeline.assert_called_with(transaction=True)
+    assert [c.args[0] for c in pipe.setex.call_args_list] == [
+        "stock:7:1mo:BBB.US",
+        "stock:7:1mo:CCC.US",
+    ]
+    assert pipe.execute.await_count == 2
+    client.delete.assert_awaited_once_with(
+        "lock:stock:7:1mo:BBB.US", "lock:stock:7:1mo:CCC.US"
+    )
+    assert list(result) == ["AAA.US", "BBB.US", "CCC.US"]
+    assert result["CCC.US"] == cached_records("CCC.US")
+
+
+def test_local_cache_serves_repeated_requests(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [None]
+    calls = []
+    endpoint = make_endpoint(calls)
+
+    first = call(endpoint, "AAA.US")
+    second = call(endpoint, "AAA.US")
+
+    assert first == second
+    assert calls == ["AAA.US"]
+    client.mget.assert_awaited_once()
+
+
+def test_local_cache_invalidation(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [None]
+    calls = []
+    endpoint = make_endpoint(calls)
+
+    call(endpoint, "AAA.US")
+    invalidate_local_cache("stock:7:1mo:AAA.US")
+    call(endpoint, "AAA.US")
+    invalidate_local_cache("*")
+    call(endpoint, "AAA.US")
+
+    assert client.mget.await_count == 3
+    assert len(local_cache) == 1
+
+
+def coalesced(scope):
+    return (
+        REGISTRY.get_sample_value(
+            "cache_coalesced_requests_total",
+            {"scope": scope, "endpoint": "background", "period": ""},
+        )
+        or 0
+    )
+
+
+def lookups(result, period="1mo"):
+    return (
+        REGISTRY.get_sample_value(
+            "cache_lookups_total",
+            {"result": result, "endpoint": "/stocks/1mo", "period": period},
+        )
+        or 0
+    )
+
+
+def serialization_seconds():
+    return (
+        REGISTRY.get_sample_value(
+            "app_serialization_duration_seconds_sum",
+            {"endpoint": "background", "period": ""},
+        )
+        or 0
+    )
+
+
+def test_serialization_latency_times_only_encoding(cache_redis, mocker):
+    client, pipe = cache_redis
+    client.mget.return_value = [None]
+    # A slow query and a slow local cache write, neither is serialization
+    mocker.patch.object(local_cache, "set", side_effect=lambda *_: time.sleep(0.2))
+    before = serialization_seconds()
+
+    call(make_endpoint([], delay=0.2), "AAA.US")
+
+    assert serialization_seconds() - before < 0.1
+
+
+def test_lookups_counted_per_tier_and_period(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [orjson.dumps(cached_records("AAA.US")), None]
+    endpoint = make_endpoint([])
+    before = {result: lookups(result) for result in ("local", "redis", "miss")}
+    token = request_labels.set({"endpoint": "/stocks/1mo", "period": "1mo"})
+    try:
+        call(endpoint, "AAA.US,BBB.US")
+        call(endpoint, "AAA.US,BBB.US")
+    finally:
+        request_labels.reset(token)
+
+    assert lookups("local") - before["local"] == 2
+    assert lookups("redis") - before["redis"] == 1
+    assert lookups("miss") - before["miss"] == 1
+    redis_calls = REGISTRY.get_sample_value(
+        "redis_command_duration_seconds_count",
+        {"operation": "get", "endpoint": "/stocks/1mo", "period": "1mo"},
+    )
+    assert redis_calls >= 1
+
+
+def test_concurrent_misses_are_computed_once(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [None]
+    calls = []
+    endpoint = make_endpoint(calls, delay=0.01)
+    before = coalesced("process")
+
+    async def burst():
+        return await asyncio.gather(*(endpoint("AAA.US", None) for _ in range(5)))
+
+    results = asyncio.run(burst())
+
+    assert calls == ["AAA.US"]
+    assert all(result.body == results[0].body for result in results)
+    assert coalesced("process") - before == 4
+    assert inflight == {}
+
+
+def test_failed_computation_reaches_waiting_requests(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [None]
+
+    @cache_stock_data(ttl=60)
+    async def get_stocks_1mo(symbols, db):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database down")
+
+    async def burst():
+        return await asyncio.gather(
+            *(get_stocks_1mo("AAA.US", None) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(burst())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert inflight == {}
+
+
+def test_waits_for_worker_holding_the_lock(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [None]
+    cached = orjson.dumps(cached_records("AAA.US"))
+    # Lock taken by another worker, which stores the key while we poll
+    pipe.execute.side_effect = [[False], [None, 1], [cached, 1]]
+    calls = []
+    before = coalesced("redis")
+
+    result = call(make_endpoint(calls), "AAA.US")
+
+    assert calls == []
+    assert result["AAA.US"] == cached_records("AAA.US")
+    assert coalesced("redis") - before == 1
+    client.delete.assert_not_awaited()
+
+
+def test_computes_when_lock_expires_without_value(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [None]
+    pipe.execute.side_effect = [[False], [None, 0], [True]]
+    calls = []
+
+    result = call(make_endpoint(calls), "AAA.US")
+
+    assert calls == ["AAA.US"]
+    assert "AAA.US" in result
+
+
+def test_encoded_records_match_response_model():
+    records = [
+        {"symbol": "AAA.US", "date": date(2025, 6, 27), "norm_1mo": Decimal("99.50")},
+        {"symbol": "AAA.US", "date": date(2025, 6, 30), "norm_1mo": None},
+    ]
+    adapter = TypeAdapter(list[Stock1MoResponse])
+
+    expected = adapter.dump_python(adapter.validate_python(records), mode="json")
+
+    assert orjson.loads(encode_records(records)) == expected
+
+
+def test_generation_read_once_until_invalidated(cache_redis):
+    client, pipe = cache_redis
+
+    async def read_twice():
+        return await get_cache_generation(), await get_cache_generation()
+
+    assert asyncio.run(read_twice()) == (7, 7)
+    client.get.assert_awaited_once_with("stock_cache:generation")
+
+    client.get.return_value = b"8"
+    invalidate_local_cache("*")
+    assert asyncio.run(get_cache_generation()) == 8
+
+
+def test_requests_follow_live_generation(cache_redis):
+    client, pipe = cache_redis
+    client.mget.return_value = [None]
+    endpoint = make_endpoint([])
+
+    call(endpoint, "AAA.US")
+    client.get.return_value = b"8"
+    invalidate_local_cache("*")
+    call(endpoint, "AAA.US")
+
+    assert [c.args[0] for c in client.mget.call_args_list] == [
+        ["stock:7:1mo:AAA.US"],
+        ["stock:8:1mo:AAA.US"],
+    ]
+
+
+@pytest.mark.parametrize("flipped", [1, 0])
+def test_publish_cache_generation(cache_redis, mocker, flipped):
+    client, pipe = cache_redis
+    client.eval = mocker.AsyncMock(return_value=flipped)
+    client.publish = mocker.AsyncMock()
+
+    assert asyncio.run(publish_cache_generation(8)) is bool(flipped)
+
+    client.eval.assert_awaited_once_with(
+        decorators.FLIP_GENERATION_SCRIPT, 1, "stock_cache:generation", 8
+    )
+    if flipped:
+        client.publish.assert_awaited_once_with("stock_cache", "*")
+    else:
+        client.publish.assert_not_awaited()
+
+
+def test_compact_encoding_round_trip():
+    records = [
+        {"symbol": "AAA.US", "date": date(2025, 6, 27), "norm_1y": Decimal("99.50")},
+        {"symbol": "AAA.US", "date": date(2025, 6, 30), "norm_1y": None},
+    ]
+    fragment = encode_records(records)
+
+    compact = encode_compact(records)
+
+    assert decode_cache_value(compact) == fragment
+    assert decode_cache_value(fragment) == fragment
+    assert decode_cache_value(encode_compact([])) == b"[]"
+
+
+def test_compact_values_stored_and_served_decoded(cache_redis, mocker):
+    client, pipe = cache_redis
+    mocker.patch.object(settings, "CACHE_COMPACT_ENCODING", True)
+    client.mget.return_value = [encode_compact(cached_records("AAA.US")), None]
+
+    result = call(make_endpoint([]), "AAA.US,BBB.US")
+
+    stored = pipe.setex.call_args.args[2]
+    assert stored == encode_compact(
+        [{"symbol": "BBB.US", "date": date(2025, 6, 30), "norm_1mo": Decimal("100.00")}]
+    )
+    assert result == {
+        "AAA.US": cached_records("AAA.US"),
+        "BBB.US": cached_records("BBB.US"),
+    }
+    # Local copies are kept decoded
+    assert local_cache.get("stock:7:1mo:AAA.US") == orjson.dumps(
+        cached_records("AAA.US")
+    )
+
+
+def make_analytics(calls):
+    @cache_analytics("performance")
+    async def get_stock_performance_extremes(timeframe, symbols, db):
+        calls.append((timeframe, symbols))
+        return {"best": {"symbol": "AAA.US", "performance_pct": Decimal("12.50")}}
+
+    return get_stock_performance_extremes
+
+
+def test_analytics_computed_once_per_symbol_set(cache_redis, mocker):
+    client, pipe = cache_redis
+    client.get = mocker.AsyncMock(side_effect=[b"7", None])
+    client.setex = mocker.AsyncMock()
+    calls = []
+    endpoint = make_analytics(calls)
+
+    first = asyncio.run(
+        endpoint(timeframe="1y", symbols="bbb.us, AAA.US,BBB.US", db=None)
+    )
+    second = asyncio.run(endpoint(timeframe="1y", symbols="AAA.US,BBB.US", db=None))
+
+    key = "analytics:7:performance:1y:AAA.US,BBB.US"
+    assert calls == [("1y", "AAA.US,BBB.US")]
+    client.setex.assert_awaited_once_with(key, 86400, first.body)
+    assert second.body == first.body
+    assert orjson.loads(first.body) == {
+        "best": {"symbol": "AAA.US", "performance_pct": 12.5}
+    }
+
+
+def test_analytics_of_every_symbol(cache_redis, mocker):
+    client, pipe = cache_redis
+    client.get = mocker.AsyncMock(side_effect=[b"7", None])
+    client.setex = mocker.AsyncMock()
+    calls = []
+    endpoint = make_analytics(calls)
+
+    asyncio.run(endpoint(timeframe="1y", symbols=None, db=None))
+    asyncio.run(endpoint(timeframe="1y", symbols=None, db=None))
+
+    # The endpoint still sees no symbols, the key stands for every stock
+    assert calls == [("1y", None)]
+    assert client.setex.call_args.args[0] == "analytics:7:performance:1y:*"
+
+
+@pytest.mark.parametrize("symbols", ["", " , "])
+def test_analytics_rejects_blank_symbols(cache_redis, mocker, symbols):
+    client, pipe = cache_redis
+    client.get = mocker.AsyncMock(return_value=b"7")
+    client.setex = mocker.AsyncMock()
+    calls = []
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(make_analytics(calls)(timeframe="1y", symbols=symbols, db=None))
+
+    assert exc_info.value.status_code == 400
+    assert calls == []
+    client.setex.assert_not_awaited()
+
+
+def test_analytics_ignores_trailing_comma(cache_redis, mocker):
+    client, pipe = cache_redis
+    client.get = mocker.AsyncMock(side_effect=[b"7", None])
+    client.setex = mocker.AsyncMock()
+    calls = []
+
+    asyncio.run(make_analytics(calls)(timeframe="1y", symbols="aaa.us,", db=None))
+
+    assert calls == [("1y", "AAA.US")]
+    assert client.setex.call_args.args[0] == "analytics:7:performance:1y:AAA.US"
+
+
+def test_analytics_served_from_redis(cache_redis, mocker):
+    client, pipe = cache_redis
+    cached = b'{"best":{"symbol":"AAA.US"}}'
+    client.get = mocker.AsyncMock(side_effect=[b"7", cached])
+    calls = []
+
+    response = asyncio.run(
+        make_analytics(calls)(timeframe="1y", symbols="AAA.US", db=None)
+    )
+
+    assert calls == []
+    assert response.body == cached
+    assert local_cache.get("analytics:7:performance:1y:AAA.US") == cached
+
+
+def test_analytics_parameters_are_part_of_the_key(cache_redis, mocker):
+    client, pipe = cache_redis
+    client.get = mocker.AsyncMock(side_effect=[b"7", None, None])
+    client.setex = mocker.AsyncMock()
+    calls = []
+
+    # Parameters are passed by keyword, their order does not matter
+    @cache_analytics("anomalies")
+    async def get_stock_anomalies(timeframe, threshold, symbols, db):
+        calls.append(threshold)
+        return {}
+
+    asyncio.run(
+        get_stock_anomalies(timeframe="1y", symbols="AAA.US", db=None, threshold=2.5)
+    )
+    asyncio.run(
+        get_stock_anomalies(timeframe="1y", symbols="AAA.US", db=None, threshold=3.0)
+    )
+    asyncio.run(
+        get_stock_anomalies(timeframe="1y", symbols="AAA.US", db=None, threshold=2.5)
+    )
+
+    assert calls == [2.5, 3.0]
+    assert [c.args[0] for c in client.setex.call_args_list] == [
+        "analytics:7:anomalies:1y:AAA.US:threshold=2.5",
+        "analytics:7:anomalies:1y:AAA.US:threshold=3.0",
+    ]
+
+
+def test_anomalies_route_threshold(cache_redis, mocker):
+    client, pipe = cache_redis
+    client.get = mocker.AsyncMock(side_effect=[b"7", None])
+    client.setex = mocker.AsyncMock()
+    get_anomalies = mocker.patch(
+        "api.routes.stocks.get_anomalies", mocker.AsyncMock(return_value={})
+    )
+    db = mocker.Mock()
+
+    # FastAPI passes every parameter by keyword
+    asyncio.run(
+        get_stock_anomalies(
+            timeframe="1y", symbols="AAA.US", db=db, threshold=3.0, window=None
+        )
+    )
+
+    get_anomalies.assert_awaited_once_with("1y", "AAA.US", db, 3.0, None)
+    # An unset window leaves the key as it was before the parameter existed
+    assert (
+        client.setex.call_args.args[0]
+        == "analytics:7:anomalies:1y:AAA.US:threshold=3.0"
+    )
@@ -0,0 +1,117 @@
+from datetime import date
+
+from redis.exceptions import ConnectionError
+
+from services import data_version as dv
+
+
+def test_max_date_read_from_redis_once(run_with_async_db, data_version):
+    data_version.client.hgetall.return_value = {
+        "AAA.US": "2025-06-30",
+        "BBB.US": "2025-06-27",
+        dv.COMPLETE_FIELD: "1",
+    }
+
+    async def scenario(db):
+        first = await data_version.get_max_date(db)
+        second = await data_version.get_max_date(db)
+        symbol = await data_version.get_symbol_max_date("BBB.US", db)
+        return first, second, symbol
+
+    first, second, symbol = run_with_async_db(scenario)
+
+    assert first == second == date(2025, 6, 30)
+    assert symbol == date(2025, 6, 27)
+    data_version.client.hgetall.assert_awaited_once()
+
+
+def test_invalidate_reloads_version(run_with_async_db, data_version):
+    data_version.client.hgetall.return_value = {
+        "AAA.US": "2025-06-27",
+        dv.COMPLETE_FIELD: "1",
+    }
+
+    async def scenario(db):
+        before = await data_version.get_max_date(db)
+        data_version.client.hgetall.return_value = {
+            "AAA.US": "2025-06-30",
+            dv.COMPLETE_FIELD: "1",
+        }
+        data_version.invalidate()
+        return before, await data_version.get_max_date(db)
+
+    before, after = run_with_async_db(scenario)
+
+    assert before == date(2025, 6, 27)
+    assert after == date(2025, 6, 30)
+
+
+def test_cold_redis_rebuilt_from_database(run_with_async_db, data_version, make_rows):
+    async def scenario(db):
+        db.add_all(make_rows("AAA.US", 5) + make_rows("BBB.US", 5, date(2025, 6, 27)))
+        await db.flush()
+        return await data_version.get_max_date(db)
+
+    assert run_with_async_db(scenario) == date(2025, 6, 30)
+    data_version.client.hset.assert_awaited_once_with(
+        dv.SYMBOL_DATES_KEY,
+        mapping={
+            "AAA.US": "2025-06-30",
+            "BBB.US": "2025-06-27",
+            dv.COMPLETE_FIELD: "1",
+        },
+    )
+
+
+def test_partial_redis_rebuilt_from_database(
+    run_with_async_db, data_version, make_rows
+):
+    # Only the symbol published after a Redis restart
+    data_version.client.hgetall.return_value = {"AAA.US": "2025-06-30"}
+
+    async def scenario(db):
+        db.add_all(make_rows("AAA.US", 5) + make_rows("BBB.US", 5, date(2025, 6, 27)))
+        await db.flush()
+        return await data_version.get_symbol_dates(db)
+
+    assert run_with_async_db(scenario) == {
+        "AAA.US": date(2025, 6, 30),
+        "BBB.US": date(2025, 6, 27),
+    }
+    data_version.client.hset.assert_awaited_once()
+
+
+def test_unreachable_redis_falls_back_to_database(
+    run_with_async_db, data_version, make_rows
+):
+    data_version.client.hgetall.side_effect = ConnectionError("down")
+
+    async def scenario(db):
+        db.add_all(make_rows("AAA.US", 5))
+        await db.flush()
+        return await data_version.get_max_date(db)
+
+    assert run_with_async_db(scenario) == date(2025, 6, 30)
+    # Nothing is kept when invalidations cannot be received
+    assert data_version.symbol_dates is None
+
+
+def test_publish_max_date(mocker):
+    client = mocker.patch("services.data_version.publish_client")
+    pipe = client.pipeline.return_value.__enter__.return_value
+
+    dv.publish_max_date("AAA.US", date(2025, 6, 30))
+
+    pipe.hset.assert_called_once_with(dv.SYMBOL_DATES_KEY, "AAA.US", "2025-06-30")
+    pipe.publish.assert_called_once_with(dv.CHANNEL, "AAA.US")
+    pipe.execute.assert_called_once()
+
+
+def test_publish_reuses_client(mocker):
+    mocker.patch("services.data_version.publish_client", None)
+    from_url = mocker.patch("services.data_version.redis.from_url")
+
+    dv.publish_max_date("AAA.US", date(2025, 6, 30))
+    dv.publish_max_date("BBB.US", date(2025, 6, 30))
+
+    from_url.assert_called_once()
@@ -0,0 +1,46 @@
+from utils.lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used_over_budget():
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.set("a", 1, 4)
+    cache.set("b", 2, 4)
+    cache.get("a")
+    cache.set("c", 3, 4)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.size == 8
+
+
+def test_replacing_entry_updates_size():
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.set("a", 1, 4)
+    cache.set("a", 2, 6)
+
+    assert cache.get("a") == 2
+    assert cache.size == 6
+    assert len(cache) == 1
+
+
+def test_entry_larger_than_budget_is_not_kept():
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.set("a", 1, 4)
+    cache.set("big", 2, 11)
+
+    assert cache.get("big") is None
+    assert cache.get("a") == 1
+
+
+def test_entries_expire_after_ttl(mocker):
+    clock = mocker.patch("utils.lru_cache.time.monotonic", return_value=100.0)
+    cache = LRUCache(max_bytes=10, ttl=30)
+    cache.set("a", 1, 4)
+
+    clock.return_value = 129.0
+    assert cache.get("a") == 1
+
+    clock.return_value = 130.0
+    assert cache.get("a") is None
+    assert cache.size == 0
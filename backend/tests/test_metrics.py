@@ -0,0 +1,117 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import ProgrammingError
+
+from api.deps import set_request_labels
+from core.metrics import instrument_engine, metrics_registry, request_labels
+from main import app
+
+
+def labels_app():
+    router = APIRouter(prefix="/stocks")
+
+    @router.get("/5y")
+    async def get_stocks_5y():
+        return request_labels.get()
+
+    @router.get("/anomalies/{timeframe}")
+    async def get_stock_anomalies(timeframe: str):
+        return request_labels.get()
+
+    api_router = APIRouter(dependencies=[Depends(set_request_labels)])
+    api_router.include_router(router)
+    test_app = FastAPI()
+    test_app.include_router(api_router, prefix="/api/v1")
+    return TestClient(test_app)
+
+
+@pytest.mark.parametrize(
+    "path, labels",
+    [
+        ("/api/v1/stocks/5y", {"endpoint": "/stocks/5y", "period": "5y"}),
+        (
+            "/api/v1/stocks/anomalies/3mo",
+            {"endpoint": "/stocks/anomalies/{timeframe}", "period": "3mo"},
+        ),
+        (
+            "/api/v1/stocks/anomalies/junk",
+            {"endpoint": "/stocks/anomalies/{timeframe}", "period": ""},
+        ),
+    ],
+)
+def test_request_labels_follow_route(path, labels):
+    assert labels_app().get(path).json() == labels
+
+
+def test_request_latency_and_size_recorded(mocker):
+    mocker.patch("api.routes.health.Session")
+    labels = {"endpoint": "/health/", "period": ""}
+    before = REGISTRY.get_sample_value("app_request_duration_seconds_count", labels)
+
+    client = TestClient(app)
+    response = client.get("/api/v1/health/")
+
+    assert response.status_code == 200
+    assert (
+        REGISTRY.get_sample_value("app_request_duration_seconds_count", labels)
+        - (before or 0)
+        == 1
+    )
+    assert REGISTRY.get_sample_value("app_response_size_bytes_sum", labels) >= len(
+        response.content
+    )
+    assert "app_request_duration_seconds_bucket" in client.get("/metrics/").text
+
+
+def query_count(labels):
+    return REGISTRY.get_sample_value("db_query_duration_seconds_count", labels) or 0
+
+
+def test_sql_latency_recorded_with_request_labels(test_db_engine):
+    engine = create_engine(test_db_engine.url)
+    instrument_engine(engine)
+    labels = {"endpoint": "/stocks/1y", "period": "1y"}
+    before = query_count(labels)
+
+    token = request_labels.set(labels)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            with pytest.raises(ProgrammingError):
+                conn.execute(text("SELECT missing_column FROM stock_data"))
+            conn.rollback()
+            conn.execute(text("SELECT 2"))
+            timers = conn.info["query_start_time"]
+    finally:
+        request_labels.reset(token)
+        engine.dispose()
+
+    assert query_count(labels) - before == 2
+    assert timers == []
+
+
+def test_multiprocess_registry_sums_all_processes(tmp_path, monkeypatch):
+    record = (
+        "from core.metrics import INGESTION_STAGE_LATENCY; "
+        "INGESTION_STAGE_LATENCY.labels(stage='download').observe(1.5)"
+    )
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", record], env=env, check=True)
+
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    registry = metrics_registry()
+
+    labels = {"stage": "download"}
+    count = "ingestion_stage_duration_seconds_count"
+    assert registry.get_sample_value(count, labels) == 2
+    assert (
+        registry.get_sample_value("ingestion_stage_duration_seconds_sum", labels) == 3
+    )
@@ -0,0 +1,47 @@
+from data.performance import get_performance_ranking
+
+
+def entry(symbol, latest_value, performance_pct):
+    return {
+        "symbol": symbol,
+        "performance_pct": performance_pct,
+        "latest_value": latest_value,
+    }
+
+
+LATEST = [
+    ("AAA.US", 112.53),
+    ("BBB.US", 87.5),
+    ("CCC.US", 112.53),
+    ("DDD.US", 87.5),
+    ("EEE.US", 101.0),
+]
+
+
+def test_best_and_worst():
+    # Ties go to the first symbol for best and the last one for worst
+    assert get_performance_ranking(LATEST) == {
+        "best": entry("AAA.US", 112.53, 12.53),
+        "worst": entry("DDD.US", 87.5, -12.5),
+    }
+
+
+def test_top_and_bottom_k():
+    result = get_performance_ranking(LATEST, top=3, bottom=2)
+
+    assert result["best"] == result["top"][0]
+    assert result["worst"] == result["bottom"][0]
+    assert [e["symbol"] for e in result["top"]] == ["AAA.US", "CCC.US", "EEE.US"]
+    assert [e["symbol"] for e in result["bottom"]] == ["DDD.US", "BBB.US"]
+
+
+def test_k_larger_than_universe():
+    result = get_performance_ranking(LATEST[:2], top=10)
+
+    assert [e["symbol"] for e in result["top"]] == ["AAA.US", "BBB.US"]
+    assert "bottom" not in result
+
+
+def test_no_prices():
+    assert get_performance_ranking([]) == {}
+    assert get_performance_ranking([], top=3) == {}
@@ -0,0 +1,191 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from data.pipeline import IngestionPipeline
+from models.stock_data import StockData
+
+
+class StooqStandIn:
+    """Local HTTP server serving CSV datasets the way stooq does."""
+
+    def __init__(
+        self, datasets: dict[str, bytes], delay: float = 0.0, etags: bool = False
+    ):
+        self.datasets = datasets
+        self.delay = delay
+        self.etags = etags
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                symbol = parse_qs(urlparse(self.path).query)["s"][0]
+                stand_in.requests.append((symbol, dict(self.headers)))
+                with stand_in.lock:
+                    stand_in.active += 1
+                    stand_in.max_active = max(stand_in.max_active, stand_in.active)
+                try:
+                    time.sleep(stand_in.delay)
+                    body = stand_in.datasets.get(symbol)
+                    if body is None:
+                        self.send_response(404)
+                        self.end_headers()
+                        return
+                    etag = f'"{hash(body)}"'
+                    if stand_in.etags and self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    if stand_in.etags:
+                        self.send_header("ETag", etag)
+                    self.send_header("Content-Type", "text/csv")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with stand_in.lock:
+                        stand_in.active -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/q/d/l/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def csv_bytes(sample_csv_data):
+    return sample_csv_data.tail(400).to_csv(index=False).encode()
+
+
+def test_pipeline_loads_all_symbols(csv_bytes, db_session, tmp_path):
+    datasets = {"aaa.us": csv_bytes, "bbb.us": csv_bytes, "ccc.us": csv_bytes}
+
+    with StooqStandIn(datasets, delay=0.2) as stooq:
+        pipeline = IngestionPipeline(
+            {symbol: symbol.replace(".", "_") for symbol in datasets},
+            base_url=stooq.url,
+            dataset_dir=str(tmp_path),
+            max_downloads=3,
+            session=db_session,
+            use_copy=True,
+        )
+        result = pipeline.run()
+
+    assert sorted(result["loaded"]) == ["aaa.us", "bbb.us", "ccc.us"]
+    assert result["failed"] == {}
+    assert stooq.max_active > 1
+
+    for symbol in ["AAA.US", "BBB.US", "CCC.US"]:
+        count = db_session.query(StockData).filter(StockData.symbol == symbol).count()
+        assert count == 400
+
+
+def test_pipeline_loads_symbols_concurrently(csv_bytes, tmp_path, mocker):
+    datasets = {f"s{i}.us": csv_bytes for i in range(4)}
+    active = []
+    overlap = []
+    lock = threading.Lock()
+
+    def load(symbol, path):
+        with lock:
+            active.append(symbol)
+            overlap.append(len(active))
+        time.sleep(0.2)
+        with lock:
+            active.remove(symbol)
+
+    mocker.patch.object(IngestionPipeline, "load", side_effect=load)
+    with StooqStandIn(datasets) as stooq:
+        pipeline = IngestionPipeline(
+            {symbol: symbol.replace(".", "_") for symbol in datasets},
+            base_url=stooq.url,
+            dataset_dir=str(tmp_path),
+            max_downloads=4,
+            max_loads=4,
+        )
+        result = pipeline.run()
+
+    assert sorted(result["loaded"]) == sorted(datasets)
+    assert max(overlap) > 1
+
+
+def test_pipeline_isolates_failing_symbols(csv_bytes, db_session, tmp_path):
+    datasets = {"good.us": csv_bytes, "bad.us": b"not,a,stooq,file\n1,2,3,4\n"}
+
+    with StooqStandIn(datasets) as stooq:
+        pipeline = IngestionPipeline(
+            {"good.us": "good_us", "bad.us": "bad_us", "missing.us": "missing_us"},
+            base_url=stooq.url,
+            dataset_dir=str(tmp_path),
+            session=db_session,
+            use_copy=True,
+        )
+        result = pipeline.run()
+
+    assert result["loaded"] == ["good.us"]
+    assert sorted(result["failed"]) == ["bad.us", "missing.us"]
+    assert "404" in result["failed"]["missing.us"]
+
+    count = db_session.query(StockData).filter(StockData.symbol == "GOOD.US").count()
+    assert count == 400
+
+
+@pytest.mark.parametrize("etags", [True, False])
+def test_pipeline_skips_unchanged_datasets(csv_bytes, db_session, tmp_path, etags):
+    with StooqStandIn({"aaa.us": csv_bytes}, etags=etags) as stooq:
+        pipeline_kwargs = dict(
+            base_url=stooq.url,
+            dataset_dir=str(tmp_path),
+            session=db_session,
+            use_copy=True,
+        )
+
+        first = IngestionPipeline({"aaa.us": "aaa_us"}, **pipeline_kwargs).run()
+        second = IngestionPipeline({"aaa.us": "aaa_us"}, **pipeline_kwargs).run()
+
+    assert first["loaded"] == ["aaa.us"]
+    assert second["loaded"] == []
+    assert second["skipped"] == ["aaa.us"]
+
+    _, headers = stooq.requests[-1]
+    assert ("If-None-Match" in headers) == etags
+    assert (tmp_path / "aaa_us_d.meta.json").exists()
+
+
+def test_pipeline_reloads_after_failed_load(csv_bytes, db_session, tmp_path):
+    with StooqStandIn({"aaa.us": csv_bytes}, etags=True) as stooq:
+        pipeline_kwargs = dict(
+            base_url=stooq.url,
+            dataset_dir=str(tmp_path),
+            session=db_session,
+            use_copy=True,
+        )
+
+        failing = IngestionPipeline({"aaa.us": "aaa_us"}, **pipeline_kwargs)
+        failing.load = lambda symbol, path: 1 / 0
+        first = failing.run()
+        assert not (tmp_path / "aaa_us_d.meta.json").exists()
+
+        second = IngestionPipeline({"aaa.us": "aaa_us"}, **pipeline_kwargs).run()
+
+    assert list(first["failed"]) == ["aaa.us"]
+    assert second["loaded"] == ["aaa.us"]
@@ -0,0 +1,112 @@
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from data.price_panel import PricePanel, load_price_panel
+
+D1, D2, D3, D4 = (date(2025, 6, day) for day in (2, 3, 4, 5))
+nan = np.nan
+
+
+def panel_from_columns(columns):
+    """Panel of (dates, values) columns per symbol, None values become NaN."""
+    lengths = [len(days) for days, _ in columns.values()]
+    return PricePanel.from_arrays(
+        list(columns),
+        np.repeat(np.arange(len(columns)), lengths),
+        np.array(
+            [day for days, _ in columns.values() for day in days],
+            dtype="datetime64[D]",
+        ).astype(np.int64),
+        np.array(
+            [value for _, values in columns.values() for value in values],
+            dtype=np.float64,
+        ),
+    )
+
+
+def sample_panel():
+    return panel_from_columns(
+        {
+            "AAA.US": ([D1, D2, D3, D4], [Decimal("100"), Decimal("110"), None, 121.0]),
+            "BBB.US": ([D2, D4], [Decimal("100.00"), Decimal("90.00")]),
+        }
+    )
+
+
+def test_columns_aligned_on_trading_dates():
+    panel = sample_panel()
+
+    assert panel.symbols == ["AAA.US", "BBB.US"]
+    assert_array_equal(panel.dates, np.array([D1, D2, D3, D4], dtype="datetime64[D]"))
+    assert_array_equal(panel.prices, [[100, nan], [110, 100], [nan, nan], [121, 90]])
+
+
+def test_returns_skip_gaps():
+    returns = sample_panel().returns()
+
+    # 121 against 110, the last price before the gap
+    assert_array_equal(returns, [[0.1, nan], [nan, nan], [0.1, -0.1]])
+
+
+def test_positions_and_forward_filled():
+    panel = sample_panel()
+
+    assert panel.positions()[[0, 1, 3], 0].tolist() == [0, 1, 2]
+    assert panel.positions()[[1, 3], 1].tolist() == [0, 1]
+    assert_array_equal(panel.forward_filled()[2], [110, 100])
+
+
+def test_empty_panel():
+    panel = panel_from_columns({})
+
+    assert panel.prices.shape == (0, 0)
+    assert panel.returns().shape == (0, 0)
+
+
+def test_from_arrays_places_unordered_rows():
+    panel = PricePanel.from_arrays(
+        ["AAA.US", "BBB.US", "CCC.US"],
+        np.array([2, 0, 0, 2, 0]),
+        np.array([D4, D1, D2, D1, D4], dtype="datetime64[D]").astype(np.int64),
+        np.array([90.0, 100.0, 110.0, 100.0, 121.0]),
+    )
+
+    # BBB.US has no rows and is left out
+    assert panel.symbols == ["AAA.US", "CCC.US"]
+    assert_array_equal(panel.dates, np.array([D1, D2, D4], dtype="datetime64[D]"))
+    assert_array_equal(panel.prices, [[100, 100], [110, nan], [121, 90]])
+
+
+def test_load_price_panel(run_with_async_db, data_version, make_rows):
+    async def scenario(db):
+        rows = make_rows("BBB.US", 10) + make_rows("AAA.US", 60)
+        rows[0].norm_1mo = None
+        db.add_all(rows)
+        await db.flush()
+        return await load_price_panel("1mo", "bbb.us,aaa.us,zzz.us", db)
+
+    panel = run_with_async_db(scenario)
+
+    # Sorted, without the symbol that has no data
+    assert panel.symbols == ["AAA.US", "BBB.US"]
+    assert panel.prices.shape == (32, 2)
+    assert panel.dates[0] == np.datetime64("2025-05-30")
+    assert panel.dates[-1] == np.datetime64("2025-06-30")
+    assert np.isnan(panel.prices[:22, 1]).all()
+    # A missing normalized price is NaN, like a missing date
+    assert np.isnan(panel.prices[-1, 1])
+    assert (panel.prices[22:-1, 1] == 100).all()
+    assert (panel.prices[:, 0] == 100).all()
+
+
+def test_load_price_panel_without_data(run_with_async_db, data_version):
+    async def scenario(db):
+        return await load_price_panel("1mo", "AAA.US", db)
+
+    panel = run_with_async_db(scenario)
+
+    assert panel.symbols == []
+    assert panel.prices.shape == (0, 0)
@@ -1,11 +1,17 @@
+from models.anomaly import Anomaly
 from models.stock_data import StockData
 from data.load_stock_data import StockDataLoader
+from data.z_score import calc_rolling_z_score
 from decimal import Decimal
 from datetime import date, datetime
 
+import numpy as np
 import pandas as pd
 import pytest
 import tempfile
+import tracemalloc
+from prometheus_client import REGISTRY
+from sqlalchemy import text
 
 
 class TestStockDataLoaderInitialization:
@@ -183,6 +189,42 @@ class TestStockDataLoaderPriceCalculations:
             assert isinstance(price, Decimal)
             assert price > 0
 
+    def test_get_base_prices_picks_nearest_trading_day(self, sample_stock_loader_class):
+        loader = sample_stock_loader_class
+
+        # Business days only, so most lookback dates fall between two rows
+        loader.db.execute(
+            text(
+                "DELETE FROM stock_data WHERE symbol = 'TEST.US' "
+                "AND extract(isodow FROM date) > 5"
+            )
+        )
+        df = loader.df[loader.df["Date"].dt.dayofweek < 5].reset_index(drop=True)
+
+        for max_date in pd.date_range("2020-01-01", "2024-12-31", freq="37D"):
+            base_prices = loader.get_base_prices(max_date.date())
+
+            for tf, price in base_prices.items():
+                target = loader.calculate_lookback_date(max_date, tf)
+                nearest_idx = abs(df["Date"] - target).idxmin()
+                assert price == round(Decimal(str(df.loc[nearest_idx, "Close"])), 2)
+
+    def test_normalized_prices_use_stored_closes(self, sample_stock_loader_class):
+        loader = sample_stock_loader_class
+        query = text(
+            "SELECT norm_1mo, norm_3mo, norm_6mo, norm_1y, norm_5y FROM stock_data "
+            "WHERE symbol = 'TEST.US' ORDER BY date"
+        )
+        expected = loader.db.execute(query).all()
+
+        # Stored closes that differ from the dataset, as after a skipped insert
+        loader.db.execute(
+            text("UPDATE stock_data SET close = close * 2 WHERE symbol = 'TEST.US'")
+        )
+        loader.calculate_normalized_prices()
+
+        assert loader.db.execute(query).all() == expected
+
     def test_update_prices(self, sample_stock_loader_class):
         loader = sample_stock_loader_class
 
@@ -252,6 +294,35 @@ class TestStockDataLoaderPriceCalculations:
             assert record.norm_1mo is not None
             assert record.norm_1mo > Decimal("0.00")
 
+    def test_calculate_normalized_prices_all_timeframes(
+        self, sample_stock_loader_class, db_session
+    ):
+        loader = sample_stock_loader_class
+
+        latest = (
+            db_session.query(StockData)
+            .filter(StockData.symbol == "TEST.US")
+            .order_by(StockData.date.desc())
+            .first()
+        )
+        assert latest.norm_1mo == round(latest.close / loader.base_price_1mo * 100, 2)
+        assert latest.norm_5y == round(latest.close / loader.base_price_5y * 100, 2)
+
+        cutoff_1mo = loader.calculate_lookback_date(pd.Timestamp(latest.date), "1mo")
+        outside_1mo = (
+            db_session.query(StockData)
+            .filter(
+                StockData.symbol == "TEST.US",
+                StockData.date < cutoff_1mo.date(),
+                StockData.date >= cutoff_1mo.date() - pd.DateOffset(days=10),
+            )
+            .all()
+        )
+        assert len(outside_1mo) > 0
+        for record in outside_1mo:
+            assert record.norm_1mo is None
+            assert record.norm_5y is not None
+
 
 class TestStockDataLoaderEdgeCases:
     def empty_csv_handling(self, db_session):
@@ -304,3 +375,495 @@ class TestStockDataLoaderIntegration:
             .count()
         )
         assert records_with_norm > 0
+
+
+class TestStockDataLoaderCopy:
+    def test_copy_inserts_all_rows(self, csv_temp_file, sample_csv_data, db_session):
+        StockDataLoader(
+            dataset=csv_temp_file, symbol="COPY.US", session=db_session, use_copy=True
+        )
+
+        count = (
+            db_session.query(StockData).filter(StockData.symbol == "COPY.US").count()
+        )
+        assert count == len(sample_csv_data)
+
+        records_with_norm = (
+            db_session.query(StockData)
+            .filter(StockData.symbol == "COPY.US", StockData.norm_1mo.isnot(None))
+            .count()
+        )
+        assert records_with_norm > 0
+
+    def test_copy_matches_insert_path(self, csv_temp_file, db_session):
+        StockDataLoader(dataset=csv_temp_file, symbol="INS.US", session=db_session)
+        StockDataLoader(
+            dataset=csv_temp_file, symbol="COPY.US", session=db_session, use_copy=True
+        )
+
+        def latest(symbol):
+            return (
+                db_session.query(StockData)
+                .filter(StockData.symbol == symbol)
+                .order_by(StockData.date.desc())
+                .first()
+            )
+
+        inserted, copied = latest("INS.US"), latest("COPY.US")
+        assert inserted.date == copied.date
+        assert inserted.close == copied.close
+        assert inserted.volume == copied.volume
+        assert inserted.norm_5y == copied.norm_5y
+
+    def test_copy_upserts_changed_rows(
+        self, csv_temp_file, sample_csv_data, db_session
+    ):
+        StockDataLoader(
+            dataset=csv_temp_file, symbol="COPY.US", session=db_session, use_copy=True
+        )
+
+        corrected = sample_csv_data.copy()
+        corrected.loc[corrected.index[-1], "Close"] = 999.99
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as f:
+            corrected.to_csv(f.name, index=False)
+            StockDataLoader(
+                dataset=f.name, symbol="COPY.US", session=db_session, use_copy=True
+            )
+
+        count = (
+            db_session.query(StockData).filter(StockData.symbol == "COPY.US").count()
+        )
+        latest = (
+            db_session.query(StockData)
+            .filter(StockData.symbol == "COPY.US")
+            .order_by(StockData.date.desc())
+            .first()
+        )
+        assert count == len(sample_csv_data)
+        assert latest.close == Decimal("999.99")
+
+
+class TestStockDataLoaderIncremental:
+    NORM_COLUMNS = ["norm_1mo", "norm_3mo", "norm_6mo", "norm_1y", "norm_5y"]
+
+    def normalized_rows(self, db_session, symbol):
+        records = (
+            db_session.query(StockData)
+            .filter(StockData.symbol == symbol)
+            .order_by(StockData.date)
+            .all()
+        )
+        return [
+            (record.date, *(getattr(record, col) for col in self.NORM_COLUMNS))
+            for record in records
+        ]
+
+    def test_incremental_matches_full_load(
+        self, csv_temp_file, sample_csv_data, db_session
+    ):
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as f:
+            sample_csv_data.iloc[:-40].to_csv(f.name, index=False)
+            StockDataLoader(dataset=f.name, symbol="DELTA.US", session=db_session)
+
+        loader = StockDataLoader(
+            dataset=csv_temp_file,
+            symbol="DELTA.US",
+            session=db_session,
+            incremental=True,
+        )
+        StockDataLoader(dataset=csv_temp_file, symbol="FULL.US", session=db_session)
+
+        assert loader.max_date == sample_csv_data["Date"].iloc[-1].date()
+        assert self.normalized_rows(db_session, "DELTA.US") == self.normalized_rows(
+            db_session, "FULL.US"
+        )
+
+    def test_incremental_with_unchanged_base_prices(self, sample_csv_data, db_session):
+        # Flat history keeps every base price except 1mo unchanged by new bars
+        data = sample_csv_data.copy()
+        data.loc[data.index[:-40], "Close"] = 100.0
+
+        with (
+            tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as old,
+            tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as new,
+        ):
+            data.iloc[:-5].to_csv(old.name, index=False)
+            data.to_csv(new.name, index=False)
+
+            StockDataLoader(dataset=old.name, symbol="DELTA.US", session=db_session)
+            StockDataLoader(
+                dataset=new.name,
+                symbol="DELTA.US",
+                session=db_session,
+                incremental=True,
+            )
+            StockDataLoader(dataset=new.name, symbol="FULL.US", session=db_session)
+
+        assert self.normalized_rows(db_session, "DELTA.US") == self.normalized_rows(
+            db_session, "FULL.US"
+        )
+
+    @pytest.mark.parametrize("chunksize", [None, 1000])
+    def test_incremental_with_revised_history(
+        self, sample_csv_data, db_session, chunksize
+    ):
+        # A 10:1 split adjusts every stored bar along with one new bar
+        adjusted = sample_csv_data.copy()
+        adjusted[["Open", "High", "Low", "Close"]] /= 10
+
+        with (
+            tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as old,
+            tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as new,
+        ):
+            sample_csv_data.iloc[:-1].to_csv(old.name, index=False)
+            adjusted.to_csv(new.name, index=False)
+
+            StockDataLoader(dataset=old.name, symbol="DELTA.US", session=db_session)
+            loader = StockDataLoader(
+                dataset=new.name,
+                symbol="DELTA.US",
+                session=db_session,
+                incremental=True,
+                chunksize=chunksize,
+            )
+            StockDataLoader(dataset=new.name, symbol="FULL.US", session=db_session)
+
+        assert loader.rows_written == len(adjusted)
+        assert self.normalized_rows(db_session, "DELTA.US") == self.normalized_rows(
+            db_session, "FULL.US"
+        )
+
+        def closes(symbol):
+            return [
+                record.close
+                for record in db_session.query(StockData)
+                .filter(StockData.symbol == symbol)
+                .order_by(StockData.date)
+            ]
+
+        assert closes("DELTA.US") == closes("FULL.US")
+
+    @pytest.mark.parametrize("chunksize", [None, 1000])
+    def test_unrevised_history_compares_only_latest_bar(
+        self, sample_csv_data, db_session, mocker, chunksize
+    ):
+        with (
+            tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as old,
+            tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as new,
+        ):
+            sample_csv_data.iloc[:-5].to_csv(old.name, index=False)
+            sample_csv_data.to_csv(new.name, index=False)
+
+            StockDataLoader(dataset=old.name, symbol="DELTA.US", session=db_session)
+            closes_differ = mocker.spy(StockDataLoader, "closes_differ")
+            loader = StockDataLoader(
+                dataset=new.name,
+                symbol="DELTA.US",
+                session=db_session,
+                incremental=True,
+                chunksize=chunksize,
+            )
+
+        closes_differ.assert_not_called()
+        assert loader.rows_written == 5
+
+    def test_trimmed_history_stays_incremental(self, sample_csv_data, db_session):
+        # The dataset starts later than the stored history, its closes match
+        with (
+            tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as old,
+            tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as new,
+        ):
+            sample_csv_data.iloc[:-5].to_csv(old.name, index=False)
+            sample_csv_data.iloc[100:].to_csv(new.name, index=False)
+
+            StockDataLoader(dataset=old.name, symbol="DELTA.US", session=db_session)
+            loader = StockDataLoader(
+                dataset=new.name,
+                symbol="DELTA.US",
+                session=db_session,
+                incremental=True,
+            )
+
+        assert loader.rows_written == 5
+        assert not loader.use_copy
+
+    def test_incremental_without_new_rows(self, csv_temp_file, db_session):
+        StockDataLoader(dataset=csv_temp_file, symbol="DELTA.US", session=db_session)
+        before = self.normalized_rows(db_session, "DELTA.US")
+
+        loader = StockDataLoader(
+            dataset=csv_temp_file,
+            symbol="DELTA.US",
+            session=db_session,
+            use_copy=True,
+            incremental=True,
+        )
+
+        assert loader.base_price_1mo == Decimal("0.00")
+        assert self.normalized_rows(db_session, "DELTA.US") == before
+
+    def test_incremental_new_symbol_loads_everything(
+        self, csv_temp_file, sample_csv_data, db_session
+    ):
+        StockDataLoader(
+            dataset=csv_temp_file,
+            symbol="NEW.US",
+            session=db_session,
+            use_copy=True,
+            incremental=True,
+        )
+
+        count = db_session.query(StockData).filter(StockData.symbol == "NEW.US").count()
+        assert count == len(sample_csv_data)
+
+
+class TestStockDataLoaderStreaming:
+    @pytest.fixture
+    def csv_50y_file(self):
+        """Synthetic 50 years of trading days"""
+        dates = pd.bdate_range(end="2025-01-01", periods=50 * 252)
+        steps = range(len(dates))
+        data = pd.DataFrame(
+            {
+                "Date": dates,
+                "Open": [100 + i * 0.01 for i in steps],
+                "High": [101 + i * 0.01 for i in steps],
+                "Low": [99 + i * 0.01 for i in steps],
+                "Close": [100.5 + i * 0.01 for i in steps],
+                "Volume": [1000000 + i for i in steps],
+            }
+        )
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as f:
+            data.to_csv(f.name, index=False)
+            yield f.name, len(data)
+
+    def test_streaming_matches_full_load(self, csv_temp_file, db_session):
+        streamed = StockDataLoader(
+            dataset=csv_temp_file, symbol="STREAM.US", session=db_session, chunksize=500
+        )
+        full = StockDataLoader(
+            dataset=csv_temp_file, symbol="FULL.US", session=db_session
+        )
+
+        def rows(symbol):
+            return [
+                (r.date, r.close, r.norm_1mo, r.norm_5y)
+                for r in db_session.query(StockData)
+                .filter(StockData.symbol == symbol)
+                .order_by(StockData.date)
+            ]
+
+        assert rows("STREAM.US") == rows("FULL.US")
+        assert streamed.base_price_5y == full.base_price_5y
+        assert streamed.df is None
+
+    def test_streaming_peak_memory_budget(self, csv_50y_file, db_session):
+        path, row_count = csv_50y_file
+
+        tracemalloc.start()
+        StockDataLoader(
+            dataset=path,
+            symbol="MEM.US",
+            session=db_session,
+            use_copy=True,
+            chunksize=1000,
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        count = db_session.query(StockData).filter(StockData.symbol == "MEM.US").count()
+        assert count == row_count
+        # Whole-file load of the same dataset peaks at roughly 7 MB
+        assert peak < 3 * 1024 * 1024
+
+
+class TestStockDataLoaderTransaction:
+    def test_failed_load_leaves_no_partial_data(self, sample_csv_data, db_session):
+        broken = sample_csv_data.astype({"Close": object})
+        broken.loc[broken.index[-1], "Close"] = "not-a-price"
+
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as f:
+            broken.to_csv(f.name, index=False)
+
+            with pytest.raises(Exception):
+                StockDataLoader(
+                    dataset=f.name,
+                    symbol="BROKEN.US",
+                    session=db_session,
+                    use_copy=True,
+                    chunksize=1000,
+                )
+
+        count = (
+            db_session.query(StockData).filter(StockData.symbol == "BROKEN.US").count()
+        )
+        assert count == 0
+
+    def test_single_commit_per_load(self, csv_temp_file, db_session, mocker):
+        commit = mocker.spy(db_session, "commit")
+
+        StockDataLoader(
+            dataset=csv_temp_file, symbol="ONCE.US", session=db_session, use_copy=True
+        )
+
+        assert commit.call_count == 1
+
+
+class TestStockDataLoaderDataVersion:
+    def test_publishes_max_date_after_commit(self, csv_temp_file, db_session, mocker):
+        mocker.patch("data.load_stock_data.Session", return_value=db_session)
+        publish = mocker.patch("data.load_stock_data.publish_max_date")
+
+        StockDataLoader(dataset=csv_temp_file, symbol="PUB.US", use_copy=True)
+
+        publish.assert_called_once_with("PUB.US", date(2025, 1, 1))
+
+    def test_provided_session_does_not_publish(self, csv_temp_file, db_session, mocker):
+        publish = mocker.patch("data.load_stock_data.publish_max_date")
+
+        StockDataLoader(dataset=csv_temp_file, symbol="PUB.US", session=db_session)
+
+        publish.assert_not_called()
+
+
+class TestStockDataLoaderMetrics:
+    def stage_count(self, stage):
+        return (
+            REGISTRY.get_sample_value(
+                "ingestion_stage_duration_seconds_count", {"stage": stage}
+            )
+            or 0
+        )
+
+    @pytest.mark.parametrize("chunksize", [None, 2])
+    def test_stages_observed_once_per_load(self, csv_temp_file, db_session, chunksize):
+        stages = ("parse", "insert", "normalize", "anomalies")
+        before = {stage: self.stage_count(stage) for stage in stages}
+
+        loader = StockDataLoader(
+            dataset=csv_temp_file,
+            symbol="TIME.US",
+            session=db_session,
+            chunksize=chunksize,
+        )
+
+        assert set(loader.stage_durations) == set(stages)
+        for stage in stages:
+            assert self.stage_count(stage) - before[stage] == 1
+
+
+class TestStockDataLoaderAnomalies:
+    @pytest.fixture
+    def random_walk_data(self):
+        """Two years of trading days with fat tailed returns"""
+        rng = np.random.default_rng(7)
+        dates = pd.bdate_range(end="2025-01-01", periods=500)
+        returns = rng.standard_t(3, len(dates) - 1) * 0.01
+        close = np.round(100 * np.cumprod(np.concatenate([[1.0], 1 + returns])), 2)
+        return pd.DataFrame(
+            {
+                "Date": dates,
+                "Open": close,
+                "High": close + 1,
+                "Low": close - 1,
+                "Close": close,
+                "Volume": 1000,
+            }
+        )
+
+    def write_csv(self, data):
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False) as f:
+            data.to_csv(f.name, index=False)
+            return f.name
+
+    def stored(self, db_session, symbol):
+        return [
+            (
+                a.window_days,
+                a.date,
+                a.bar_index,
+                round(a.daily_return, 10),
+                round(a.z_score, 8),
+            )
+            for a in db_session.query(Anomaly)
+            .filter(Anomaly.symbol == symbol)
+            .order_by(Anomaly.window_days, Anomaly.date)
+        ]
+
+    @pytest.mark.parametrize("batch_bars", [5000, 97])
+    def test_full_load_stores_rolling_anomalies(
+        self, random_walk_data, db_session, mocker, batch_bars
+    ):
+        # Batches smaller than the history are seeded with the bars before them
+        mocker.patch("data.load_stock_data.ANOMALY_BATCH_BARS", batch_bars)
+        StockDataLoader(
+            dataset=self.write_csv(random_walk_data),
+            symbol="ROLL.US",
+            session=db_session,
+        )
+
+        closes = random_walk_data["Close"].to_numpy()
+        dates = random_walk_data["Date"].dt.date.tolist()
+        expected = []
+        for window in (20, 60):
+            bars, returns, z_scores = calc_rolling_z_score(closes, window)
+            expected += [
+                (window, dates[bar], bar, round(r, 10), round(z, 8))
+                for bar, r, z in zip(bars.tolist(), returns.tolist(), z_scores.tolist())
+            ]
+
+        assert expected
+        assert self.stored(db_session, "ROLL.US") == expected
+
+    @pytest.mark.parametrize("batch_bars", [5000, 7])
+    def test_incremental_matches_full_load(
+        self, random_walk_data, db_session, mocker, batch_bars
+    ):
+        mocker.patch("data.load_stock_data.ANOMALY_BATCH_BARS", batch_bars)
+        StockDataLoader(
+            dataset=self.write_csv(random_walk_data.iloc[:-30]),
+            symbol="DELTA.US",
+            session=db_session,
+        )
+        StockDataLoader(
+            dataset=self.write_csv(random_walk_data),
+            symbol="DELTA.US",
+            session=db_session,
+            use_copy=True,
+            incremental=True,
+        )
+        StockDataLoader(
+            dataset=self.write_csv(random_walk_data),
+            symbol="FULL.US",
+            session=db_session,
+        )
+
+        assert self.stored(db_session, "DELTA.US") == self.stored(db_session, "FULL.US")
+
+    def test_incremental_scores_history_without_stored_anomalies(
+        self, random_walk_data, db_session
+    ):
+        StockDataLoader(
+            dataset=self.write_csv(random_walk_data.iloc[:-30]),
+            symbol="DELTA.US",
+            session=db_session,
+        )
+        full = self.stored(db_session, "DELTA.US")
+        # As for symbols loaded before the anomalies table existed
+        db_session.query(Anomaly).delete()
+
+        StockDataLoader(
+            dataset=self.write_csv(random_walk_data.iloc[:-30]),
+            symbol="DELTA.US",
+            session=db_session,
+            incremental=True,
+        )
+        assert self.stored(db_session, "DELTA.US") == []
+
+        StockDataLoader(
+            dataset=self.write_csv(random_walk_data.iloc[:-29]),
+            symbol="DELTA.US",
+            session=db_session,
+            incremental=True,
+        )
+        assert set(full) <= set(self.stored(db_session, "DELTA.US"))
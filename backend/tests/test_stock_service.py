@@ -0,0 +1,179 @@
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from models.anomaly import Anomaly
+from services.analytics import get_anomalies
+from services.stocks import (
+    get_latest_values_by_period_async,
+    get_stock_arrays_by_period_async,
+    get_stock_prices_by_period_async,
+    parse_period_copy,
+)
+
+
+def test_period_prices_async(run_with_async_db, data_version, make_rows):
+    async def scenario(db):
+        db.add_all(make_rows("AAA.US", 60) + make_rows("BBB.US", 10))
+        await db.flush()
+        return await get_stock_prices_by_period_async("1mo", "aaa.us, bbb.us", db)
+
+    result = run_with_async_db(scenario)
+
+    assert sorted(result) == ["AAA.US", "BBB.US"]
+    # 2025-05-30 .. 2025-06-30 inclusive
+    assert len(result["AAA.US"]) == 32
+    assert len(result["BBB.US"]) == 10
+    dates = [row["date"] for row in result["AAA.US"]]
+    assert dates == sorted(dates)
+    # Only the columns the 1mo response carries are selected
+    assert result["AAA.US"][0] == {
+        "symbol": "AAA.US",
+        "date": date(2025, 5, 30),
+        "norm_1mo": Decimal("100.00"),
+    }
+
+
+def test_period_arrays_async(run_with_async_db, data_version, make_rows):
+    async def scenario(db):
+        db.add_all(make_rows("AAA.US", 60) + make_rows("BBB.US", 10))
+        await db.flush()
+        return await get_stock_arrays_by_period_async("1mo", "BBB.US,AAA.US", db)
+
+    symbols, codes, days, values = run_with_async_db(scenario)
+
+    assert symbols == ["AAA.US", "BBB.US"]
+    assert np.bincount(codes).tolist() == [32, 10]
+    dates = days[codes == 0].astype("datetime64[D]")
+    assert dates.min() == np.datetime64("2025-05-30")
+    assert dates.max() == np.datetime64("2025-06-30")
+    assert values.dtype == np.float64
+    assert (values == 100).all()
+
+
+def test_parse_period_copy_skips_header_extension():
+    row = (
+        (3).to_bytes(2, "big")
+        + (4).to_bytes(4, "big")
+        + (2).to_bytes(4, "big")
+        + (4).to_bytes(4, "big")
+        + (20000).to_bytes(4, "big")
+        + (8).to_bytes(4, "big")
+        + np.array([101.5], dtype=">f8").tobytes()
+    )
+    data = (
+        b"PGCOPY\n\xff\r\n\x00"
+        + bytes(4)
+        + (3).to_bytes(4, "big")
+        + b"ext"
+        + row * 2
+        + b"\xff\xff"
+    )
+
+    codes, days, values = parse_period_copy(data)
+
+    assert codes.tolist() == [2, 2]
+    assert days.tolist() == [20000, 20000]
+    assert values.tolist() == [101.5, 101.5]
+
+
+def test_period_prices_async_invalid_period(run_with_async_db, data_version):
+    async def scenario(db):
+        return await get_stock_prices_by_period_async("2w", "AAA.US", db)
+
+    with pytest.raises(HTTPException) as exc:
+        run_with_async_db(scenario)
+
+    assert exc.value.status_code == 400
+
+
+def test_rolling_anomalies_lookup(run_with_async_db, data_version, make_rows):
+    def anomaly(symbol, window, day, z_score):
+        return Anomaly(
+            symbol=symbol,
+            window_days=window,
+            date=date(2025, *day),
+            # make_rows starts on 2025-05-02
+            bar_index=(date(2025, *day) - date(2025, 5, 2)).days,
+            daily_return=0.0512345,
+            z_score=z_score,
+        )
+
+    async def scenario(db):
+        db.add_all(make_rows("AAA.US", 60) + make_rows("BBB.US", 60))
+        db.add_all(
+            [
+                anomaly("AAA.US", 20, (6, 10), 3.14159),
+                anomaly("AAA.US", 20, (6, 20), -2.6),
+                # Before the period, of another window, of another symbol
+                anomaly("AAA.US", 20, (5, 10), 4.0),
+                anomaly("AAA.US", 60, (6, 11), 4.0),
+                anomaly("BBB.US", 20, (6, 12), 4.0),
+            ]
+        )
+        await db.flush()
+        return (
+            await get_anomalies("1mo", "AAA.US", db, threshold=2.5, window=20),
+            await get_anomalies("1mo", "AAA.US", db, threshold=3.0, window=20),
+        )
+
+    default, strict = run_with_async_db(scenario)
+
+    # 2025-05-30 .. 2025-06-09 come before the first anomaly in the period
+    first = {"date_index": 11, "price": 100.0, "return_pct": 5.12, "z_score": 3.14}
+    assert default == {
+        "AAA.US": [
+            first,
+            {"date_index": 21, "price": 100.0, "return_pct": 5.12, "z_score": -2.6},
+        ]
+    }
+    assert strict == {"AAA.US": [first]}
+
+
+@pytest.mark.parametrize("window, threshold", [(30, 2.5), (20, 2.0)])
+def test_rolling_anomalies_invalid_parameters(
+    run_with_async_db, data_version, window, threshold
+):
+    async def scenario(db):
+        return await get_anomalies("1mo", "AAA.US", db, threshold, window)
+
+    with pytest.raises(HTTPException) as exc:
+        run_with_async_db(scenario)
+
+    assert exc.value.status_code == 400
+
+
+def test_latest_values_by_period(run_with_async_db, data_version, make_rows):
+    async def scenario(db):
+        rows = make_rows("BBB.US", 10) + make_rows("AAA.US", 60)
+        # The latest bar without a normalized price falls back to the one before
+        rows[0].norm_1mo = None
+        rows[1].norm_1mo = Decimal("97.25")
+        rows.append(make_rows("OLD.US", 5, end=date(2025, 4, 1))[0])
+        for row in rows[10:]:
+            row.norm_1mo = Decimal("105.50")
+        db.add_all(rows)
+        await db.flush()
+        return (
+            await get_latest_values_by_period_async("1mo", "bbb.us,aaa.us,old.us", db),
+            await get_latest_values_by_period_async("1mo", None, db),
+        )
+
+    requested, universe = run_with_async_db(scenario)
+
+    # OLD.US has no price in the period
+    assert requested == [("AAA.US", 105.5), ("BBB.US", 97.25)]
+    assert universe == requested
+
+
+def test_latest_values_invalid_period(run_with_async_db, data_version):
+    async def scenario(db):
+        return await get_latest_values_by_period_async("2w", None, db)
+
+    with pytest.raises(HTTPException) as exc:
+        run_with_async_db(scenario)
+
+    assert exc.value.status_code == 400
@@ -0,0 +1,99 @@
+import asyncio
+
+from prometheus_client import REGISTRY
+
+from data import tasks
+
+
+def test_new_generation_is_prewarmed_before_going_live(mocker):
+    order = []
+    mocker.patch.object(tasks.cache_client, "incr", mocker.AsyncMock(return_value=4))
+    mocker.patch(
+        "data.tasks.precache_stock_data",
+        mocker.AsyncMock(
+            side_effect=lambda generation: order.append("prewarm") or True
+        ),
+    )
+    mocker.patch(
+        "data.tasks.publish_cache_generation",
+        mocker.AsyncMock(side_effect=lambda generation: order.append("flip")),
+    )
+
+    assert asyncio.run(tasks.start_new_generation()) == 4
+
+    tasks.precache_stock_data.assert_awaited_once_with(4)
+    tasks.publish_cache_generation.assert_awaited_once_with(4)
+    assert order == ["prewarm", "flip"]
+
+
+def test_failed_prewarm_keeps_live_generation(mocker):
+    mocker.patch.object(tasks.cache_client, "incr", mocker.AsyncMock(return_value=4))
+    mocker.patch("data.tasks.precache_stock_data", mocker.AsyncMock(return_value=False))
+    publish = mocker.patch("data.tasks.publish_cache_generation", mocker.AsyncMock())
+
+    assert asyncio.run(tasks.start_new_generation()) is None
+
+    publish.assert_not_awaited()
+
+
+def test_ingestion_without_changes_rewarms_live_generation(mocker):
+    pipeline = mocker.patch("data.tasks.IngestionPipeline")
+    pipeline.return_value.run.return_value = {
+        "loaded": [],
+        "skipped": ["aapl.us"],
+        "failed": {},
+    }
+    start_new_generation = mocker.patch("data.tasks.start_new_generation")
+    precache = mocker.patch("data.tasks.precache_stock_data")
+    mocker.patch("data.tasks.run_async", side_effect=asyncio.run)
+
+    tasks.download_and_load_stock_data()
+
+    start_new_generation.assert_not_called()
+    # Without a generation the live one is written
+    precache.assert_awaited_once_with()
+
+
+def test_precache_analytics_uses_endpoint_keys(mocker):
+    mocker.patch("data.tasks.AsyncSession")
+    setex = mocker.patch.object(tasks.cache_client, "setex", mocker.AsyncMock())
+    mocker.patch("data.tasks.get_anomalies", mocker.AsyncMock(return_value={}))
+    mocker.patch(
+        "data.tasks.get_performance",
+        mocker.AsyncMock(return_value={"best": {"symbol": "AAA.US"}}),
+    )
+
+    assert asyncio.run(tasks.precache_analytics(4, "bbb.us,aaa.us", 60))
+
+    keys = [c.args[0] for c in setex.call_args_list]
+    assert len(keys) == 10
+    assert "analytics:4:anomalies:1mo:AAA.US,BBB.US:threshold=2.5" in keys
+    assert "analytics:4:performance:5y:AAA.US,BBB.US" in keys
+    tasks.get_performance.assert_any_await("5y", "AAA.US,BBB.US", mocker.ANY)
+    tasks.get_anomalies.assert_any_await(
+        "1mo", "AAA.US,BBB.US", mocker.ANY, threshold=2.5
+    )
+
+
+def test_precache_analytics_reports_failures(mocker):
+    mocker.patch("data.tasks.AsyncSession")
+    mocker.patch.object(tasks.cache_client, "setex", mocker.AsyncMock())
+    mocker.patch("data.tasks.get_anomalies", mocker.AsyncMock(return_value={}))
+    mocker.patch(
+        "data.tasks.get_performance", mocker.AsyncMock(side_effect=RuntimeError)
+    )
+
+    assert not asyncio.run(tasks.precache_analytics(4, "aaa.us", 60))
+
+
+def test_worker_serves_multiprocess_metrics(mocker, tmp_path):
+    mocker.patch.dict("os.environ", {"PROMETHEUS_MULTIPROC_DIR": str(tmp_path)})
+    (tmp_path / "histogram_123.db").write_bytes(b"stale")
+    server = mocker.patch("data.tasks.start_http_server")
+
+    tasks.start_metrics_server()
+
+    assert list(tmp_path.iterdir()) == []
+    port, registry = server.call_args.args[0], server.call_args.kwargs["registry"]
+    assert port == 9808
+    assert registry is not REGISTRY
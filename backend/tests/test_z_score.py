@@ -0,0 +1,144 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from data.z_score import calc_rolling_z_score, calc_z_score
+from tests.test_price_panel import panel_from_columns
+
+
+def reference_z_score(numpy_prices_arr, threshold=2.5):
+    # Per symbol, per return loop the panel kernel replaced
+    results = {}
+    for symbol, prices in numpy_prices_arr.items():
+        if len(prices) < 2:
+            continue
+        returns = np.diff(prices) / prices[:-1]
+        mean_return = np.mean(returns)
+        std_return = np.std(returns)
+        if std_return == 0:
+            continue
+        anomalies = [
+            {
+                "date_index": i + 1,
+                "price": prices[i + 1],
+                "return_pct": round(daily_ret * 100, 2),
+                "z_score": round((daily_ret - mean_return) / std_return, 2),
+            }
+            for i, daily_ret in enumerate(returns)
+            if abs((daily_ret - mean_return) / std_return) > threshold
+        ]
+        if anomalies:
+            results[symbol] = anomalies
+    return results
+
+
+def random_prices(seed, days):
+    rng = np.random.default_rng(seed)
+    # Fat tailed returns so every symbol has some outliers
+    returns = rng.standard_t(3, days - 1) * 0.01
+    return np.round(100 * np.cumprod(np.concatenate([[1.0], 1 + returns])), 2)
+
+
+def make_panel(prices, missing=()):
+    """Panel of price arrays ending on the same date, without the missing days."""
+    end = date(2025, 6, 30)
+    columns = {}
+    for symbol, values in prices.items():
+        dates = [end - timedelta(days=len(values) - 1 - i) for i in range(len(values))]
+        columns[symbol] = (
+            [day for i, day in enumerate(dates) if (symbol, i) not in missing],
+            [value for i, value in enumerate(values) if (symbol, i) not in missing],
+        )
+    return panel_from_columns(columns)
+
+
+@pytest.mark.parametrize("threshold", [2.0, 2.5, 4.0])
+def test_matches_per_symbol_loop(threshold):
+    prices = {f"S{i:02d}.US": random_prices(i, 200 + 37 * i) for i in range(12)}
+    # Days missing for single symbols leave gaps in their columns
+    missing = {("S03.US", 10), ("S03.US", 11), ("S07.US", 150), ("S11.US", 0)}
+    kept = {
+        symbol: np.array(
+            [v for i, v in enumerate(values) if (symbol, i) not in missing]
+        )
+        for symbol, values in prices.items()
+    }
+
+    result = calc_z_score(make_panel(prices, missing), threshold)
+
+    assert result == reference_z_score(kept, threshold)
+    assert list(result) == sorted(result)
+
+
+def test_flat_and_short_series_have_no_anomalies():
+    prices = {
+        "FLAT.US": np.full(50, 100.0),
+        "MOVE.US": np.array([100.0] * 20 + [150.0] + [150.0] * 20),
+        "ONE.US": np.array([100.0]),
+    }
+
+    result = calc_z_score(make_panel(prices))
+
+    assert list(result) == ["MOVE.US"]
+    assert result["MOVE.US"] == [
+        {"date_index": 20, "price": 150.0, "return_pct": 50.0, "z_score": 6.24}
+    ]
+    assert calc_z_score(panel_from_columns({})) == {}
+
+
+def test_higher_threshold_returns_fewer_anomalies():
+    panel = make_panel({"AAA.US": random_prices(1, 1260)})
+
+    loose = calc_z_score(panel, 2.0)["AAA.US"]
+    strict = calc_z_score(panel, 3.5)["AAA.US"]
+
+    assert len(strict) < len(loose)
+    assert all(abs(anomaly["z_score"]) > 3.5 for anomaly in strict)
+
+
+def reference_rolling_z_score(prices, window, threshold=2.5):
+    # Mean and standard deviation recomputed over every window
+    returns = np.diff(prices) / prices[:-1]
+    found = []
+    for i in range(window, len(returns)):
+        previous = returns[i - window : i]
+        std_return = np.std(previous)
+        if std_return == 0:
+            continue
+        z_score = (returns[i] - np.mean(previous)) / std_return
+        if abs(z_score) > threshold:
+            found.append((i + 1, returns[i], z_score))
+    return found
+
+
+@pytest.mark.parametrize("window", [5, 20, 60])
+def test_rolling_matches_windowed_statistics(window):
+    prices = random_prices(window, 1260)
+
+    bars, returns, z_scores = calc_rolling_z_score(prices, window)
+    expected = reference_rolling_z_score(prices, window)
+
+    assert bars.tolist() == [bar for bar, _, _ in expected]
+    np.testing.assert_allclose(returns, [r for _, r, _ in expected])
+    np.testing.assert_allclose(z_scores, [z for _, _, z in expected])
+
+
+def test_rolling_scores_only_bars_from_start():
+    prices = random_prices(3, 500)
+    bars, _, z_scores = calc_rolling_z_score(prices, 20)
+
+    # Earlier prices only seed the running sums
+    later, _, later_z = calc_rolling_z_score(prices[300 - 21 :], 20, start=21)
+
+    assert (later + 300 - 21).tolist() == bars[bars >= 300].tolist()
+    np.testing.assert_allclose(later_z, z_scores[bars >= 300])
+
+
+def test_rolling_flat_and_short_series():
+    flat_then_jump = np.array([100.0] * 30 + [150.0])
+
+    # Every window of the flat series has no deviation to score against
+    assert calc_rolling_z_score(flat_then_jump, 20)[0].tolist() == []
+    assert calc_rolling_z_score(np.array([100.0, 101.0]), 20)[0].tolist() == []
+    assert calc_rolling_z_score(np.array([]), 20)[0].tolist() == []
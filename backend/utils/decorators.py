@@ -1,47 +1,410 @@
-import json
+import asyncio
+import uuid
 from functools import wraps
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
+from fastapi import HTTPException, Response
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
 import redis.asyncio as redis
 
 from core.config import settings
+from core.metrics import (
+    CACHE_LOOKUPS_COUNTER,
+    COALESCED_REQUESTS_COUNTER,
+    REDIS_LATENCY,
+    SERIALIZATION_LATENCY,
+    labelled,
+)
+from utils.lru_cache import LRUCache
+from utils.serialization import (
+    decode_cache_value,
+    encode_analytics,
+    encode_cache_value,
+    encode_records,
+    join_symbol_fragments,
+)
 
 redis_client = redis.Redis(
     host=settings.REDIS_HOST, port=6379, db=0, decode_responses=True
 )
 
+# Cached payloads are encoded JSON or compact values, kept as bytes end to end
+cache_client = redis.Redis(host=settings.REDIS_HOST, port=6379, db=0)
+
+# Per worker copy of the hottest Redis entries, always plain JSON fragments
+local_cache = LRUCache(settings.LOCAL_CACHE_MAX_BYTES, settings.LOCAL_CACHE_TTL)
+
+# Carries cache keys to drop from every local cache, "*" drops everything
+CACHE_INVALIDATION_CHANNEL = "stock_cache"
+
+# Generation the API serves, and the counter handing out new generations
+CACHE_GENERATION_KEY = "stock_cache:generation"
+CACHE_NEXT_GENERATION_KEY = "stock_cache:next_generation"
+
+# Raises the live generation, never lowers it
+FLIP_GENERATION_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# In-process copy of the live generation, (generation, expires_at)
+cached_generation: tuple[int, float] | None = None
+
+# Cache keys being computed in this worker, later requests await the result
+inflight: dict[str, asyncio.Future] = {}
+
+CACHE_LOCK_POLL_INTERVAL = 0.05
+
+
+def stock_cache_key(generation: int, period: str, symbol: str) -> str:
+    # Entries hold one symbol's records encoded in the response format,
+    # old generations are never read again and expire by TTL
+    return f"stock:{generation}:{period}:{symbol}"
+
+
+def normalize_symbols(symbols: str) -> list[str]:
+    # Blank entries, such as after a trailing comma, are dropped
+    return sorted({s.strip().upper() for s in symbols.split(",")} - {""})
+
+
+def require_symbols(symbols: str) -> list[str]:
+    """Normalized symbols of a request, a 400 when none are left."""
+    symbol_list = normalize_symbols(symbols)
+    if not symbol_list:
+        raise HTTPException(status_code=400, detail="No symbols given")
+    return symbol_list
+
+
+def analytics_cache_key(
+    generation: int,
+    kind: str,
+    timeframe: str,
+    symbol_list: list[str] | None,
+    **params,
+) -> str:
+    # No symbol list stands for every stock, keyed as "*"
+    symbols = "*" if symbol_list is None else ",".join(symbol_list)
+    # Extra query parameters, such as the anomaly threshold, are part of the
+    # key. Ones left unset are not, so adding a parameter keeps existing keys
+    key = f"analytics:{generation}:{kind}:{timeframe}:{symbols}"
+    return key + "".join(
+        f":{name}={value}"
+        for name, value in sorted(params.items())
+        if value is not None
+    )
+
+
+async def read_cache_generation() -> int:
+    return int(await cache_client.get(CACHE_GENERATION_KEY) or 0)
+
+
+async def get_cache_generation() -> int:
+    """
+    Live generation, re-read after an invalidation or after LOCAL_CACHE_TTL
+    so a missed announcement only delays the switch.
+    """
+    global cached_generation
+    loop = asyncio.get_running_loop()
+    if cached_generation is None or cached_generation[1] <= loop.time():
+        generation = await read_cache_generation()
+        cached_generation = (generation, loop.time() + settings.LOCAL_CACHE_TTL)
+    return cached_generation[0]
+
+
+async def publish_cache_generation(generation: int) -> bool:
+    """Make a pre-warmed generation live and tell the API workers."""
+    flipped = await cache_client.eval(
+        FLIP_GENERATION_SCRIPT, 1, CACHE_GENERATION_KEY, generation
+    )
+    if flipped:
+        await cache_client.publish(CACHE_INVALIDATION_CHANNEL, "*")
+    return bool(flipped)
+
+
+def invalidate_local_cache(key: str) -> None:
+    global cached_generation
+    if key == "*":
+        local_cache.clear()
+        cached_generation = None
+    else:
+        local_cache.pop(key)
+
+
+async def listen_for_cache_invalidations() -> None:
+    """Apply invalidations published by the cache and ingestion tasks."""
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                # Invalidations may have been missed while disconnected
+                invalidate_local_cache("*")
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        invalidate_local_cache(message["data"])
+        except RedisError as e:
+            print(f"Cache invalidation listener disconnected: {e}")
+            invalidate_local_cache("*")
+            await asyncio.sleep(5)
+
+
+async def wait_for_cache_fill(cache_key: str) -> bytes | None:
+    """
+    Wait for the worker holding the key's lock to store it.
+    Returns None when the lock is released or expires without a value.
+    """
+    while True:
+        await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+        async with cache_client.pipeline(transaction=False) as pipe:
+            pipe.get(cache_key)
+            pipe.exists(f"lock:{cache_key}")
+            with labelled(REDIS_LATENCY, operation="get").time():
+                cached_data, locked = await pipe.execute()
+
+        if cached_data or not locked:
+            return cached_data
+
+
+async def compute_and_store(func, key_for, symbols, ttl, db, *args, **kwargs):
+    """Load symbols from the database and store them in both cache tiers."""
+    if not symbols:
+        return {}
+
+    db_results = await func(",".join(symbols), db, *args, **kwargs)
+
+    # Response fragment and Redis value of every symbol
+    with labelled(SERIALIZATION_LATENCY).time():
+        encoded = {
+            symbol: (encode_records(records), encode_cache_value(records))
+            for symbol, records in db_results.items()
+        }
+
+    results = {}
+    # All misses are written in one pipelined transaction
+    async with cache_client.pipeline(transaction=True) as pipe:
+        for symbol, (fragment, value) in encoded.items():
+            cache_key = key_for(symbol)
+            pipe.setex(cache_key, ttl, value)
+            local_cache.set(cache_key, fragment, len(fragment))
+            results[symbol] = fragment
+        with labelled(REDIS_LATENCY, operation="set").time():
+            await pipe.execute()
+
+    return results
+
+
+async def load_missing(func, key_for, symbols, ttl, db, *args, **kwargs):
+    """
+    Compute the symbols this worker holds the Redis lock for, and wait for
+    the other workers computing the rest.
+    """
+    cache_keys = [key_for(symbol) for symbol in symbols]
+    token = uuid.uuid4().hex
+
+    async with cache_client.pipeline(transaction=False) as pipe:
+        for cache_key in cache_keys:
+            pipe.set(f"lock:{cache_key}", token, nx=True, px=settings.CACHE_LOCK_TTL_MS)
+        with labelled(REDIS_LATENCY, operation="lock").time():
+            acquired = await pipe.execute()
+
+    locked = [symbol for symbol, ok in zip(symbols, acquired) if ok]
+    waiting = [symbol for symbol, ok in zip(symbols, acquired) if not ok]
+
+    try:
+        results, filled = await asyncio.gather(
+            compute_and_store(func, key_for, locked, ttl, db, *args, **kwargs),
+            asyncio.gather(*(wait_for_cache_fill(key_for(s)) for s in waiting)),
+        )
+    finally:
+        # A lock that already expired may belong to another worker by now,
+        # deleting it only lets one more worker compute the key
+        if locked:
+            await cache_client.delete(*(f"lock:{key_for(s)}" for s in locked))
+
+    unfilled = []
+    for symbol, cached_data in zip(waiting, filled):
+        if cached_data:
+            labelled(COALESCED_REQUESTS_COUNTER, scope="redis").inc()
+            fragment = decode_cache_value(cached_data)
+            local_cache.set(key_for(symbol), fragment, len(fragment))
+            results[symbol] = fragment
+        else:
+            unfilled.append(symbol)
+
+    # Lock holders that gave up without a value
+    results.update(
+        await compute_and_store(func, key_for, unfilled, ttl, db, *args, **kwargs)
+    )
+
+    return results
+
 
 def cache_stock_data(ttl: int = 86400):
+    """
+    Cache each symbol's records as encoded JSON. The response body is spliced
+    from the cached fragments and returned as is, so hits never decode or
+    re-encode the data.
+    """
+
     def decorator(func):
         @wraps(func)
-        async def wrapper(symbols: str, db: Session, *args, **kwargs):
-            symbol_list = sorted([s.strip().upper() for s in symbols.split(",")])
+        async def wrapper(symbols: str, db: AsyncSession, *args, **kwargs):
+            symbol_list = require_symbols(symbols)
             period = func.__name__.split("_")[-1]
+            generation = await get_cache_generation()
+
+            def key_for(symbol: str) -> str:
+                return stock_cache_key(generation, period, symbol)
 
-            final_response = {}
+            fragments = {}
+            missing_locally = []
             missing_from_cache = []
 
             for symbol in symbol_list:
-                cache_key = f"stock:{period}:{symbol}"
-                cached_data = await redis_client.get(cache_key)
+                cached_data = local_cache.get(key_for(symbol))
+                if cached_data is not None:
+                    fragments[symbol] = cached_data
+                else:
+                    missing_locally.append(symbol)
+
+            if missing_locally:
+                # One round trip for all symbols
+                cache_keys = [key_for(s) for s in missing_locally]
+                with labelled(REDIS_LATENCY, operation="get").time():
+                    cached_values = await cache_client.mget(cache_keys)
+
+                for symbol, cache_key, cached_data in zip(
+                    missing_locally, cache_keys, cached_values
+                ):
+                    if cached_data:
+                        fragment = decode_cache_value(cached_data)
+                        local_cache.set(cache_key, fragment, len(fragment))
+                        fragments[symbol] = fragment
+                    else:
+                        missing_from_cache.append(symbol)
+
+            local_hits = len(symbol_list) - len(missing_locally)
+            redis_hits = len(missing_locally) - len(missing_from_cache)
+            labelled(CACHE_LOOKUPS_COUNTER, result="local").inc(local_hits)
+            labelled(CACHE_LOOKUPS_COUNTER, result="redis").inc(redis_hits)
+            labelled(CACHE_LOOKUPS_COUNTER, result="miss").inc(len(missing_from_cache))
 
-                if cached_data:
-                    final_response[symbol] = json.loads(cached_data)
+            # Single flight, a key missing in several concurrent requests of
+            # this worker is computed by the first one only
+            owned = []
+            shared = {}
+            loop = asyncio.get_running_loop()
+            for symbol in missing_from_cache:
+                cache_key = key_for(symbol)
+                if cache_key in inflight:
+                    shared[symbol] = inflight[cache_key]
                 else:
-                    missing_from_cache.append(symbol)
+                    inflight[cache_key] = loop.create_future()
+                    owned.append(symbol)
 
-            if missing_from_cache:
-                missing_symbols_str = ",".join(missing_from_cache)
-                db_results = await func(missing_symbols_str, db, *args, **kwargs)
+            if owned:
+                try:
+                    results = await load_missing(
+                        func, key_for, owned, ttl, db, *args, **kwargs
+                    )
+                except asyncio.CancelledError:
+                    for symbol in owned:
+                        inflight.pop(key_for(symbol)).cancel()
+                    raise
+                except Exception as e:
+                    for symbol in owned:
+                        future = inflight.pop(key_for(symbol))
+                        future.set_exception(e)
+                        # Marks the exception as retrieved when nobody waits
+                        future.exception()
+                    raise
+
+                for symbol in owned:
+                    future = inflight.pop(key_for(symbol))
+                    future.set_result(results.get(symbol))
+                fragments.update(results)
+
+            abandoned = []
+            for symbol, future in shared.items():
+                try:
+                    # Shielded, a cancelled request must not cancel the computation
+                    data = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+                    # The computing request was cancelled, load it here instead
+                    abandoned.append(symbol)
+                    continue
+
+                labelled(COALESCED_REQUESTS_COUNTER, scope="process").inc()
+                if data is not None:
+                    fragments[symbol] = data
+
+            if abandoned:
+                fragments.update(
+                    await load_missing(
+                        func, key_for, abandoned, ttl, db, *args, **kwargs
+                    )
+                )
+
+            with labelled(SERIALIZATION_LATENCY).time():
+                body = join_symbol_fragments(
+                    {s: fragments[s] for s in symbol_list if s in fragments}
+                )
+            return Response(content=body, media_type="application/json")
+
+        return wrapper
 
-                for symbol, data in db_results.items():
-                    serialized = jsonable_encoder(data)
-                    await redis_client.setex(
-                        f"stock:{period}:{symbol}", ttl, json.dumps(serialized)
+    return decorator
+
+
+def cache_analytics(kind: str, ttl: int = 86400):
+    """
+    Cache an analytics result per timeframe, symbol set and extra keyword
+    parameters as encoded JSON. Everything is passed by keyword, as FastAPI
+    calls endpoints.
+    Results belong to the cache generation, so ingestion retires them.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(
+            *, timeframe: str, symbols: str | None, db: AsyncSession, **params
+        ):
+            # No symbols stands for every stock, an empty one is a client error
+            symbol_list = None if symbols is None else require_symbols(symbols)
+            generation = await get_cache_generation()
+            cache_key = analytics_cache_key(
+                generation, kind, timeframe, symbol_list, **params
+            )
+
+            body = local_cache.get(cache_key)
+            if body is not None:
+                labelled(CACHE_LOOKUPS_COUNTER, result="local").inc()
+            else:
+                with labelled(REDIS_LATENCY, operation="get").time():
+                    body = await cache_client.get(cache_key)
+                if body is not None:
+                    labelled(CACHE_LOOKUPS_COUNTER, result="redis").inc()
+                else:
+                    labelled(CACHE_LOOKUPS_COUNTER, result="miss").inc()
+                    result = await func(
+                        timeframe=timeframe,
+                        symbols=(
+                            ",".join(symbol_list) if symbol_list is not None else None
+                        ),
+                        db=db,
+                        **params,
                     )
-                    final_response[symbol] = serialized
+                    with labelled(SERIALIZATION_LATENCY).time():
+                        body = encode_analytics(result)
+                    with labelled(REDIS_LATENCY, operation="set").time():
+                        await cache_client.setex(cache_key, ttl, body)
+                local_cache.set(cache_key, body, len(body))
 
-            return final_response
+            return Response(content=body, media_type="application/json")
 
         return wrapper
 
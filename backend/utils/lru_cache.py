@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class LRUCache:
+    """
+    In-process least recently used cache bounded by the total size of its
+    entries in bytes. Every entry also expires after ttl seconds.
+    Not thread safe, meant for a single event loop.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (expires_at, size, value), oldest first
+        self.entries: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+        self.size = 0
+
+    def get(self, key: str) -> Any | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self.pop(key)
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int) -> None:
+        self.pop(key)
+
+        # An entry larger than the whole budget would only flush the cache
+        if size > self.max_bytes:
+            return
+
+        self.entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def pop(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,87 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import orjson
+import zstandard
+from fastapi.encoders import jsonable_encoder
+
+from core.config import settings
+
+# Frame header every zstd payload starts with
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+compressor = zstandard.ZstdCompressor(level=3)
+decompressor = zstandard.ZstdDecompressor()
+
+
+def encode_default(obj):
+    # Same representation the response models produce: dates as midnight
+    # datetimes and decimals as strings
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, date):
+        return f"{obj.isoformat()}T00:00:00"
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def encode_records(records) -> bytes:
+    """Encode one symbol's records as a JSON array in the response format."""
+    return orjson.dumps(
+        records, default=encode_default, option=orjson.OPT_PASSTHROUGH_DATETIME
+    )
+
+
+def encode_compact(records) -> bytes:
+    """
+    Compact cache encoding of one symbol's records: the response fields
+    stored as columns, zstd compressed.
+    """
+    fields = list(records[0]) if records else []
+    columns = [[record[field] for record in records] for field in fields]
+    return compressor.compress(
+        orjson.dumps(
+            {"fields": fields, "columns": columns},
+            default=encode_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+    )
+
+
+def decode_compact(payload: bytes) -> bytes:
+    """Rebuild the JSON array encode_records produces from a compact payload."""
+    data = orjson.loads(decompressor.decompress(payload))
+    fields = data["fields"]
+    return orjson.dumps([dict(zip(fields, row)) for row in zip(*data["columns"])])
+
+
+def encode_cache_value(records) -> bytes:
+    """Value stored in Redis, compact only when CACHE_COMPACT_ENCODING is on."""
+    if settings.CACHE_COMPACT_ENCODING:
+        return encode_compact(records)
+    return encode_records(records)
+
+
+def decode_cache_value(payload: bytes) -> bytes:
+    """JSON array of a Redis value in either encoding."""
+    if payload.startswith(ZSTD_MAGIC):
+        return decode_compact(payload)
+    return payload
+
+
+def encode_analytics(result) -> bytes:
+    """Encode an analytics result as the default JSON response would."""
+    return orjson.dumps(jsonable_encoder(result), option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def join_symbol_fragments(fragments: dict[str, bytes]) -> bytes:
+    """Splice already encoded per symbol arrays into one JSON object."""
+    return (
+        b"{"
+        + b",".join(
+            orjson.dumps(symbol) + b":" + fragment
+            for symbol, fragment in fragments.items()
+        )
+        + b"}"
+    )